@@ -133,3 +133,621 @@ print(albert.average_grade())
 
 # The API is incompatible with that of the dictionary-based implementation, but if needed it is possible to write
 # backwards-compatible ones.
+
+
+# Columnar Storage
+# Each grade costs a namedtuple in a list in a Subject in a dictionary of a Student, which adds up to more than a
+# hundred bytes per grade. Questions across students, like the average per subject, also have to walk through all of
+# these objects. A columnar layout instead stores the grades in typed arrays, one for each field. Student and subject
+# names are replaced by small integer ids, so each name is stored only once. The classes from above turn into
+# lightweight views that remember the ids, which keeps the usage exactly the same:
+from array import array
+
+class ColumnarGradebook(object):
+    def __init__(self):
+        self._student_names, self._student_ids = [], {}
+        self._subject_names, self._subject_ids = [], {}
+        self._students = array('I')
+        self._subjects = array('I')
+        self._scores = array('d')
+        self._weights = array('d')
+        self._student_rows = {}  # Student id -> array of the row numbers of its grades
+
+    @staticmethod
+    def _encode(names, ids, name):
+        if name not in ids:
+            ids[name] = len(names)
+            names.append(name)
+        return ids[name]
+
+    def student(self, name):
+        return ColumnarStudent(self, self._encode(self._student_names, self._student_ids, name))
+
+    def _report_grade(self, student_id, subject_id, score, weight):
+        if student_id not in self._student_rows:
+            self._student_rows[student_id] = array('I')
+        self._student_rows[student_id].append(len(self._students))
+        self._students.append(student_id)
+        self._subjects.append(subject_id)
+        self._scores.append(score)
+        self._weights.append(weight)
+
+    def _rows(self):
+        return zip(self._students, self._subjects, self._scores, self._weights)
+
+    def _rows_of(self, student_id):
+        subjects, scores, weights = self._subjects, self._scores, self._weights
+        return ((student_id, subjects[i], scores[i], weights[i]) for i in self._student_rows.get(student_id, ()))
+
+    def _totals(self, key, student_id=None, subject_id=None):
+        # Sums of weighted scores and weights per key, optionally restricted to one student or subject
+        totals = {}
+        rows = self._rows() if student_id is None else self._rows_of(student_id)
+        for student, subject, score, weight in rows:
+            if student_id is not None and student != student_id or subject_id is not None and subject != subject_id:
+                continue
+            entry = totals.setdefault(key(student, subject), [0, 0])
+            entry[0] += score * weight
+            entry[1] += weight
+        return totals
+
+    def subject_averages(self):
+        totals = self._totals(lambda student, subject: subject)
+        return {self._subject_names[subject]: total / weight for subject, (total, weight) in totals.items()}
+
+    def student_averages(self):
+        averages = {}
+        for (student, _), (total, weight) in self._totals(lambda student, subject: (student, subject)).items():
+            averages.setdefault(self._student_names[student], []).append(total / weight)
+        return {name: sum(values) / len(values) for name, values in averages.items()}
+
+class ColumnarStudent(object):
+    def __init__(self, book, student_id):
+        self._book = book
+        self._student_id = student_id
+
+    def subject(self, name):
+        book = self._book
+        return ColumnarSubject(book, self._student_id, book._encode(book._subject_names, book._subject_ids, name))
+
+    def average_grade(self):
+        totals = self._book._totals(lambda student, subject: subject, student_id=self._student_id)
+        return sum(total / weight for total, weight in totals.values()) / len(totals)
+
+class ColumnarSubject(object):
+    def __init__(self, book, student_id, subject_id):
+        self._book = book
+        self._student_id = student_id
+        self._subject_id = subject_id
+
+    def report_grade(self, score, weight):
+        self._book._report_grade(self._student_id, self._subject_id, score, weight)
+
+    def average_grade(self):
+        totals = self._book._totals(lambda student, subject: subject, self._student_id, self._subject_id)
+        total, weight = totals.get(self._subject_id, (0, 0))  # No grades divide by zero like Subject does
+        return total / weight
+
+book = ColumnarGradebook()
+albert = book.student('Albert Einstein')
+math = albert.subject('Math')
+math.report_grade(80, 0.10)
+math.report_grade(90, 0.15)
+math.report_grade(85, 0.10)
+albert.subject('Gym').report_grade(100, 0.20)
+book.student('Isaac Newton').subject('Math').report_grade(95, 0.30)
+print(math.average_grade(), albert.average_grade())
+print(book.subject_averages())
+
+# 85.71428571428572 92.85714285714286
+# {'Math': 90.00000000000001, 'Gym': 100.0}
+
+# The arrays need 24 bytes per grade, plus 4 for the row number in the index that lets queries about a single student
+# only visit the grades of that student. Compared with the object-based gradebook:
+import random
+import tracemalloc
+
+def measure(book_class, count=200000):
+    random.seed(1)
+    tracemalloc.start()
+    book = book_class()
+    students = [book.student('Student %d' % i) for i in range(1000)]
+    for _ in range(count):
+        random.choice(students).subject(random.choice(['Math', 'Gym', 'Art'])).report_grade(
+            random.randint(0, 100), random.random())
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / count
+
+print('Gradebook: %.0f bytes per grade' % measure(Gradebook))
+print('ColumnarGradebook: %.0f bytes per grade' % measure(ColumnarGradebook))
+
+# Gradebook: 101 bytes per grade
+# ColumnarGradebook: 31 bytes per grade
+
+# The object-based gradebook benefits here from small integer scores, which Python caches; with float scores it needs
+# even more. Thanks to the index, the averages of a single student cost as much as in the object model, while questions
+# across students scan the arrays.
+
+
+# Running Averages
+# Subject.average_grade sums up all grades again on every call, and Student.average_grade does so for every subject.
+# Instead, the sums can be updated whenever a grade is reported, which makes the averages O(1). The weighted variant
+# of Welford's algorithm maintains the variance in the same way, without the loss of precision of summing up squares:
+class RunningSubject(Subject):
+    def __init__(self, on_change=None):
+        super().__init__()
+        self._on_change = on_change  # Called with the old and the new average
+        self.count = 0
+        self.total = 0  # Sum of score * weight
+        self.total_weight = 0
+        self.minimum = None
+        self.maximum = None
+        self._mean = 0.0
+        self._squares = 0.0  # Weighted sum of squared differences from the mean
+
+    def report_grade(self, score, weight):
+        old_average = self.average_grade() if self.total_weight else None
+        super().report_grade(score, weight)
+        self.count += 1
+        self.total += score * weight
+        self.total_weight += weight
+        if self.total_weight:  # Grades with weight 0 don't count until a weighted one arrives
+            delta = score - self._mean
+            self._mean += delta * weight / self.total_weight
+            self._squares += weight * delta * (score - self._mean)
+        self.minimum = score if self.minimum is None else min(self.minimum, score)
+        self.maximum = score if self.maximum is None else max(self.maximum, score)
+        if self._on_change is not None and self.total_weight:
+            self._on_change(old_average, self.average_grade())
+
+    def average_grade(self):
+        return self.total / self.total_weight
+
+    def variance(self):
+        return self._squares / self.total_weight
+
+# A student's average is the mean of the subject averages, so the student keeps their sum up to date. It passes a hook
+# to its subjects (see item 23) that reports each change of an average:
+class RunningStudent(Student):
+    def __init__(self):
+        super().__init__()
+        self._average_sum = 0
+        self._graded = 0  # Subjects with at least one grade
+
+    def subject(self, name):
+        if not name in self._subjects:
+            self._subjects[name] = RunningSubject(self._subject_changed)
+        return self._subjects[name]
+
+    def _subject_changed(self, old_average, new_average):
+        if old_average is None:
+            self._graded += 1
+            self._average_sum += new_average
+        else:
+            self._average_sum += new_average - old_average
+
+    def average_grade(self):
+        return self._average_sum / self._graded
+
+class RunningGradebook(Gradebook):
+    def student(self, name):
+        if not name in self._students:
+            self._students[name] = RunningStudent()
+        return self._students[name]
+
+book = RunningGradebook()
+albert = book.student('Albert Einstein')
+math = albert.subject('Math')
+math.report_grade(80, 0.10)
+math.report_grade(90, 0.15)
+math.report_grade(85, 0.10)
+albert.subject('Gym').report_grade(100, 0.20)
+print(math.average_grade(), albert.average_grade())
+print('Variance %.2f between %d and %d' % (math.variance(), math.minimum, math.maximum))
+
+# 85.71428571428572 92.85714285714286
+# Variance 17.35 between 80 and 90
+
+# Updating the sum of averages by differences accumulates rounding errors over millions of grades, which is
+# negligible for reporting purposes.
+
+
+# Bulk Loading
+# Reporting grades one at a time costs two dictionary lookups, several method calls and an update of all running
+# statistics per grade. When many grades are imported at once, e.g. from a CSV file, it's cheaper to group them by
+# student and subject first and then hand each group to its subject in one call. The subject updates its statistics in
+# a loop over local variables and notifies the student only once per group:
+import csv
+import itertools
+import os
+
+class BulkSubject(RunningSubject):
+    def report_grades(self, grades):
+        if not grades:
+            return
+        old_average = self.average_grade() if self.total_weight else None
+        self._grades.extend(itertools.starmap(Grade, grades))
+        total, total_weight, mean, squares = self.total, self.total_weight, self._mean, self._squares
+        for score, weight in grades:
+            total += score * weight
+            total_weight += weight
+            if not total_weight:
+                continue  # Like in report_grade, weight 0 doesn't count until a weighted grade arrives
+            delta = score - mean
+            mean += delta * weight / total_weight
+            squares += weight * delta * (score - mean)
+        self.total, self.total_weight, self._mean, self._squares = total, total_weight, mean, squares
+        self.count += len(grades)
+        scores = [score for score, _ in grades]
+        self.minimum = min(scores) if self.minimum is None else min(self.minimum, min(scores))
+        self.maximum = max(scores) if self.maximum is None else max(self.maximum, max(scores))
+        if self._on_change is not None and self.total_weight:
+            self._on_change(old_average, self.average_grade())
+
+class BulkStudent(RunningStudent):
+    def subject(self, name):
+        if not name in self._subjects:
+            self._subjects[name] = BulkSubject(self._subject_changed)
+        return self._subjects[name]
+
+CSV_COLUMNS = ('student', 'subject', 'score', 'weight')
+
+class BulkGradebook(RunningGradebook):
+    def student(self, name):
+        if not name in self._students:
+            self._students[name] = BulkStudent()
+        return self._students[name]
+
+    def bulk_load(self, rows, batch_size=100000):
+        # rows are (student, subject, score, weight) tuples or the path of a CSV file with a header row that names
+        # these columns, in any order
+        if isinstance(rows, (str, os.PathLike)):
+            with open(rows, newline='') as f:
+                reader = csv.DictReader(f)  # Skips blank lines
+                missing = set(CSV_COLUMNS).difference(reader.fieldnames or CSV_COLUMNS)
+                if missing:
+                    raise ValueError('%s lacks the columns %s' % (rows, ', '.join(sorted(missing))))
+                self.bulk_load(((row['student'], row['subject'], float(row['score']), float(row['weight']))
+                                for row in reader), batch_size)
+            return
+
+        rows = iter(rows)
+        while True:
+            groups = {}
+            for student, subject, score, weight in itertools.islice(rows, batch_size):
+                groups.setdefault((student, subject), []).append((score, weight))
+            if not groups:
+                return
+            for (student, subject), grades in groups.items():
+                self.student(student).subject(subject).report_grades(grades)
+
+# The batch size bounds the memory needed for grouping. Both ways lead to the same statistics:
+import timeit
+from tempfile import TemporaryDirectory
+
+random.seed(1)
+rows = [('Student %d' % random.randrange(1000), random.choice(['Math', 'Gym', 'Art']),
+         random.randint(0, 100), random.random()) for _ in range(200000)]
+
+def report_each(rows):
+    book = BulkGradebook()
+    for student, subject, score, weight in rows:
+        book.student(student).subject(subject).report_grade(score, weight)
+    return book
+
+def load_bulk(rows):
+    book = BulkGradebook()
+    book.bulk_load(rows)
+    return book
+
+assert abs(report_each(rows).student('Student 7').average_grade() -
+           load_bulk(rows).student('Student 7').average_grade()) < 1e-9
+for name, load in [('report_grade', report_each), ('bulk_load', load_bulk)]:
+    seconds = min(timeit.repeat(lambda: load(rows), number=1, repeat=3))
+    print('%s: %.0f rows/sec' % (name, len(rows) / seconds))
+
+with TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, 'grades.csv')
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+        writer.writerows(rows)
+        writer.writerow([])  # A trailing blank line
+    seconds = min(timeit.repeat(lambda: load_bulk(path), number=1, repeat=3))
+    print('bulk_load from CSV: %.0f rows/sec' % (len(rows) / seconds))
+
+# report_grade: 610330 rows/sec
+# bulk_load: 862898 rows/sec
+# bulk_load from CSV: 345160 rows/sec
+
+# Most of the remaining time goes into the running statistics and the Grade objects. Parsing the CSV file into one
+# dictionary per row costs about one and a half times as much as loading the parsed rows.
+
+
+# Ranking Students
+# So far the gradebook can only answer questions about a single student. Questions like "who are the top ten students"
+# or "is this student in the top 1%" require the averages of all students in order. Re-averaging every student for
+# each such query is wasteful, so the gradebook keeps a sorted list of (average, name) pairs instead. Students report
+# changes of their average through another hook, and the gradebook moves the affected entry with the bisect module.
+# Each update is a binary search plus a fast memory move inside the list. The same hook also passes on the changes of
+# the subject averages, which the gradebook keeps in one sorted list per subject for the distribution of a subject:
+import functools
+from bisect import bisect_left, insort
+
+class RankedStudent(BulkStudent):
+    def __init__(self, on_change=None, on_subject_change=None):
+        super().__init__()
+        self._on_change = on_change  # Called with the old and the new average
+        self._on_subject_change = on_subject_change  # Called with the subject, the old and the new average
+
+    def subject(self, name):
+        if not name in self._subjects:
+            self._subjects[name] = BulkSubject(functools.partial(self._subject_changed, name))
+        return self._subjects[name]
+
+    def _subject_changed(self, name, old_average, new_average):
+        old_student_average = self.average_grade() if self._graded else None
+        super()._subject_changed(old_average, new_average)
+        if self._on_subject_change is not None:
+            self._on_subject_change(name, old_average, new_average)
+        if self._on_change is not None:
+            self._on_change(old_student_average, self.average_grade())
+
+def exclusive_quantiles(data, n):
+    # Like statistics.quantiles(data, n=n) with the default method, but for data that is already sorted, which makes
+    # each cut point O(1)
+    m = len(data) + 1
+    quantiles = []
+    for i in range(1, n):
+        j = min(max(i * m // n, 1), len(data) - 1)
+        delta = i * m - j * n
+        quantiles.append((data[j - 1] * (n - delta) + data[j] * delta) / n)
+    return quantiles
+
+class RankedGradebook(BulkGradebook):
+    def __init__(self):
+        super().__init__()
+        self._ranking = []  # Sorted (average, name) pairs
+        self._subject_averages = {}  # Subject -> sorted averages of the students who have grades in it
+        self._subject_sums = {}  # Subject -> sum of these averages
+
+    def student(self, name):
+        if not name in self._students:
+            self._students[name] = RankedStudent(functools.partial(self._student_changed, name),
+                                                 self._subject_changed)
+        return self._students[name]
+
+    def _subject_changed(self, subject, old_average, new_average):
+        averages = self._subject_averages.setdefault(subject, [])
+        if old_average is not None:
+            del averages[bisect_left(averages, old_average)]
+        insort(averages, new_average)
+        self._subject_sums[subject] = self._subject_sums.get(subject, 0) + new_average - (old_average or 0)
+
+    def _student_changed(self, name, old_average, new_average):
+        if old_average is not None:
+            del self._ranking[bisect_left(self._ranking, (old_average, name))]
+        insort(self._ranking, (new_average, name))
+
+    def top(self, k):
+        if k <= 0:
+            return []  # self._ranking[-0:] would be the whole list
+        return [(name, average) for average, name in reversed(self._ranking[-k:])]
+
+    def top_percent(self, percent):
+        return self.top(max(1, round(len(self._ranking) * percent / 100)))
+
+    def percentile_rank(self, name):
+        # Percentage of students with a lower average
+        below = bisect_left(self._ranking, (self._students[name].average_grade(),))
+        return 100 * below / len(self._ranking)
+
+    def subject_distribution(self, subject, n=4):
+        averages = self._subject_averages.get(subject)
+        if not averages:
+            return {'students': 0, 'mean': None, 'quantiles': []}
+        if len(averages) == 1:
+            quantiles = averages * (n - 1)  # Interpolation needs two values, all cut points are the only one
+        else:
+            quantiles = exclusive_quantiles(averages, n)
+        return {'students': len(averages), 'mean': self._subject_sums[subject] / len(averages),
+                'quantiles': quantiles}
+
+# For millions of students, the list moves become noticeable and an order-statistic tree like the BalancedTree from
+# item 28 would keep updates logarithmic.
+book = RankedGradebook()
+book.bulk_load(rows)
+print('Top 3:', [(name, round(average, 1)) for name, average in book.top(3)])
+print('Top 1%:', len(book.top_percent(1)), 'students')
+print('Student 7 is better than %.1f%% of the students' % book.percentile_rank('Student 7'))
+distribution = book.subject_distribution('Math')
+print('Math: %d students, quartiles %s' % (distribution['students'],
+                                           [round(value, 1) for value in distribution['quantiles']]))
+
+# Top 3: [('Student 137', 57.6), ('Student 44', 57.1), ('Student 431', 56.7)]
+# Top 1%: 10 students
+# Student 7 is better than 54.6% of the students
+# Math: 1000 students, quartiles [47.0, 49.6, 52.7]
+
+
+# Snapshots
+# Every process that needs a gradebook has to build it from the raw grades first. The columnar layout is close to a
+# file format already, though: a header with the counts, the two tables of names and one fixed-width record per grade.
+# Names are stored as UTF-8 bytes behind an array of offsets. All numbers are little-endian, and sections start at
+# multiples of eight bytes:
+import mmap
+import struct
+import sys
+
+SNAPSHOT_MAGIC = b'GRDB'
+SNAPSHOT_HEADER = struct.Struct('<4sIIII')  # Magic, version, number of students, subjects and grades
+GRADE_RECORD = struct.Struct('<IIdd')  # Student id, subject id, score, weight
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _write_names(f, names):
+    encoded = [name.encode('utf-8') for name in names]
+    offsets = array('I', itertools.accumulate(map(len, encoded), initial=0))
+    f.write(_little_endian(offsets))
+    f.write(b''.join(encoded))
+    f.write(bytes(-f.tell() % 8))
+
+def save_snapshot(book, path):
+    # The number of grades is only known once all rows are written, e.g. for a SnapshotGradebook, so the header is
+    # written again at the end
+    def header(grades):
+        return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 1, len(book._student_names), len(book._subject_names), grades)
+
+    with open(path, 'wb') as f:
+        f.write(header(0))
+        f.write(bytes(-f.tell() % 8))
+        _write_names(f, book._student_names)
+        _write_names(f, book._subject_names)
+        rows = book._rows()
+        grades = 0
+        while True:
+            batch = b''.join(itertools.starmap(GRADE_RECORD.pack, itertools.islice(rows, 100000)))
+            if not batch:
+                break
+            f.write(batch)
+            grades += len(batch) // GRADE_RECORD.size
+        f.seek(0)
+        f.write(header(grades))
+
+# Loading maps the file into memory instead of reading it. Only the names are decoded, the grade records are unpacked
+# straight from the mapped pages whenever a query scans them. So a cold start only costs the page faults for the data
+# that is actually used, and processes that map the same snapshot share these pages through the operating system's
+# page cache. SnapshotGradebook reuses the columnar views by replacing the source of the rows, and refuses changes:
+class SnapshotGradebook(ColumnarGradebook):
+    def __init__(self, path):
+        super().__init__()
+        self._student_rows = None  # Built on demand by _rows_of
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        try:
+            if len(view) < SNAPSHOT_HEADER.size:
+                raise ValueError('%s is not a gradebook snapshot' % path)
+            magic, version, students, subjects, grades = SNAPSHOT_HEADER.unpack_from(view)
+            if magic != SNAPSHOT_MAGIC or version != 1:
+                raise ValueError('%s is not a gradebook snapshot' % path)
+            offset = SNAPSHOT_HEADER.size + -SNAPSHOT_HEADER.size % 8
+            offset = self._read_names(view, offset, students, self._student_names, self._student_ids)
+            offset = self._read_names(view, offset, subjects, self._subject_names, self._subject_ids)
+            if offset is None or len(view) < offset + grades * GRADE_RECORD.size:
+                raise ValueError('%s is truncated, it should hold %d grades' % (path, grades))
+        except BaseException:
+            view.release()  # The map can't be closed while a view exports it
+            self._mmap.close()
+            raise
+        self._records = view[offset:offset + grades * GRADE_RECORD.size]
+        view.release()
+
+    @staticmethod
+    def _read_names(view, offset, count, names, ids):
+        # Returns the offset of the next section, or None if the file ends before this one does
+        if offset is None or len(view) < offset + 4 * (count + 1):
+            return None
+        offsets = struct.unpack_from('<%dI' % (count + 1), view, offset)
+        start = offset + 4 * (count + 1)
+        if len(view) < start + offsets[count]:
+            return None
+        for i in range(count):
+            name = bytes(view[start + offsets[i]:start + offsets[i + 1]]).decode('utf-8')
+            ids[name] = len(names)
+            names.append(name)
+        end = start + offsets[count]
+        return end + -end % 8
+
+    def _rows(self):
+        return GRADE_RECORD.iter_unpack(self._records)
+
+    def _rows_of(self, student_id):
+        # The snapshot doesn't store the index of rows per student, it is built by one scan on the first query about
+        # a single student, which keeps opening the snapshot cheap
+        if self._student_rows is None:
+            self._student_rows = {}
+            for row, (student, _, _, _) in enumerate(self._rows()):
+                if student not in self._student_rows:
+                    self._student_rows[student] = array('I')
+                self._student_rows[student].append(row)
+        records, size = self._records, GRADE_RECORD.size
+        return (GRADE_RECORD.unpack_from(records, i * size) for i in self._student_rows.get(student_id, ()))
+
+    @staticmethod
+    def _encode(names, ids, name):
+        # Looks names up without adding them, student() and subject() share this
+        if name not in ids:
+            raise KeyError('%r is not in the snapshot' % (name,))
+        return ids[name]
+
+    def _report_grade(self, student_id, subject_id, score, weight):
+        raise TypeError('Snapshots are read-only')
+
+    def close(self):
+        # An iterator from _rows() that is still alive, e.g. in the traceback of a failed query, keeps the records
+        # exported, and exported memory can't be unmapped. The snapshot then drops its references, so the memory is
+        # unmapped as soon as the last such iterator is gone.
+        if self._mmap is None:
+            return
+        records, mapped = self._records, self._mmap
+        self._records = self._mmap = None
+        try:
+            records.release()
+            mapped.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Rebuilding the columnar gradebook from the rows of the previous examples compared with opening its snapshot:
+def build_columnar(rows):
+    book = ColumnarGradebook()
+    for student, subject, score, weight in rows:
+        book.student(student).subject(subject).report_grade(score, weight)
+    return book
+
+columnar = build_columnar(rows)
+with TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, 'grades.snapshot')
+    save_snapshot(columnar, path)
+    print('Snapshot of %d grades has %d bytes' % (len(rows), os.path.getsize(path)))
+
+    with SnapshotGradebook(path) as snapshot:
+        assert snapshot.subject_averages() == columnar.subject_averages()
+        print(snapshot.student('Student 7').subject('Math').average_grade() ==
+              columnar.student('Student 7').subject('Math').average_grade())
+        copy = os.path.join(tmpdir, 'copy.snapshot')
+        save_snapshot(snapshot, copy)  # Snapshots can be saved again
+
+    with SnapshotGradebook(copy) as snapshot:
+        assert snapshot.subject_averages() == columnar.subject_averages()
+    with open(copy, 'r+b') as f:
+        f.truncate(os.path.getsize(copy) - GRADE_RECORD.size)
+    try:
+        SnapshotGradebook(copy)
+    except ValueError as e:
+        print('ValueError:', os.path.basename(str(e)))
+
+    print('Rebuild: %.1f ms' % (1000 * min(timeit.repeat(lambda: build_columnar(rows), number=1, repeat=3))))
+    print('Open snapshot: %.1f ms' % (1000 * min(timeit.repeat(lambda: SnapshotGradebook(path).close(),
+                                                                number=1, repeat=3))))
+
+# Snapshot of 200000 grades has 4814952 bytes
+# True
+# ValueError: copy.snapshot is truncated, it should hold 200000 grades
+# Rebuild: 206.3 ms
+# Open snapshot: 0.5 ms
+
+# Opening the snapshot only costs decoding the thousand student names. Queries pay for unpacking the records they scan
+# instead. The first query about a single student also builds the index of rows per student, later ones only unpack
+# the records of that student.
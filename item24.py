@@ -35,7 +35,7 @@ class Worker(object):
 class LineCountWorker(Worker):
     def map(self):
         data = self.input_data.read()
-        count = data.count('\n')
+        self.result = data.count('\n')
 
     def reduce(self, other):
         self.result += other.result
@@ -73,14 +73,18 @@ def mapreduce(data_dir):
 from tempfile import TemporaryDirectory
 
 def write_test_files(tmpdir):
-    # ...
-    pass
+    for i in range(100):
+        with open(os.path.join(tmpdir, str(i)), 'w') as f:
+            f.write('\n' * i)
 
-with TemporaryDirectory() as tmpdir:
-    write_test_files(tmpdir)
-    result = mapreduce(tmpdir)
+if __name__ == '__main__':
+    with TemporaryDirectory() as tmpdir:
+        write_test_files(tmpdir)
+        result = mapreduce(tmpdir)
 
-print('There are', result, 'lines')
+    print('There are', result, 'lines')
+
+# There are 4950 lines
 
 
 # The problem with this approach is that the mapreduce function is not generic at all. If you want to use another
@@ -134,7 +138,7 @@ class GenericWorker(object):
 class LineCountWorker(GenericWorker):
     def map(self):
         data = self.input_data.read()
-        count = data.count('\n')
+        self.result = data.count('\n')
 
     def reduce(self, other):
         self.result += other.result
@@ -145,8 +149,1045 @@ def mapreduce(worker_class, input_class, config):
     return execute(workers)
 
 # Now the usage example can be rewritten like this:
-with TemporaryDirectory() as tmpdir:
-    write_test_files(tmpdir)
-    config = {'data_dir': tmpdir}
-    result = mapreduce(LineCountWorker, PathInputData, config)
+if __name__ == '__main__':
+    with TemporaryDirectory() as tmpdir:
+        write_test_files(tmpdir)
+        config = {'data_dir': tmpdir}
+        result = mapreduce(LineCountWorker, PathInputData, config)
+
+    print('There are', result, 'lines')
+
+# There are 4950 lines
+
+
+# Pluggable Executors
+# execute() still starts one thread per worker. Because of the GIL (see item 37) the map steps don't run in parallel
+# and thousands of input files mean thousands of threads. The concurrent.futures module provides interchangeable
+# executors for threads and processes, so the strategy can be chosen when mapreduce is called. A serial executor that
+# runs everything inline completes the set and is useful for debugging:
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+class SerialExecutor(Executor):
+    def __init__(self, max_workers=None):
+        pass  # Accepted to be interchangeable with the pool executors
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+EXECUTORS = {
+    'serial': SerialExecutor,
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+# Workers that run in another process are pickled, so the mapped copy has to be sent back to the caller for the
+# reduce step. chunksize batches several workers into one message, which cuts the IPC overhead for many small files:
+def run_map(worker):
+    worker.map()
+    return worker
+
+def execute(workers, executor='thread', max_workers=None, chunksize=1):
+    with EXECUTORS[executor](max_workers=max_workers) as pool:
+        workers = list(pool.map(run_map, workers, chunksize=chunksize))
+
+    first, rest = workers[0], workers[1:]
+    for worker in rest:
+        first.reduce(worker)
+    return first.result
+
+def mapreduce(worker_class, input_class, config, executor='thread', max_workers=None, chunksize=1):
+    workers = worker_class.create_workers(input_class, config)
+    return execute(workers, executor=executor, max_workers=max_workers, chunksize=chunksize)
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as tmpdir:
+        write_test_files(tmpdir)
+        config = {'data_dir': tmpdir}
+        for executor in EXECUTORS:
+            result = mapreduce(LineCountWorker, PathInputData, config,
+                               executor=executor, max_workers=os.cpu_count(), chunksize=10)
+            print(executor, 'executor counted', result, 'lines')
+
+# serial executor counted 4950 lines
+# thread executor counted 4950 lines
+# process executor counted 4950 lines
+
+# Only the process pool scales with the number of cores for CPU-bound map steps. On platforms which spawn instead of
+# fork new processes (Windows, macOS) every child process imports the main module again, so all examples in this module
+# are guarded by if __name__ == '__main__'. Otherwise importing this module would start pools recursively, and every
+# child process would run the examples above once more.
+
+
+# Streaming Reads
+# PathInputData.read() decodes the whole file into one string before the newlines are counted, so each worker holds a
+# complete file in memory. Counting newlines doesn't need decoded text, so a subclass can instead yield fixed-size
+# binary chunks. Memory per worker is then bounded by the chunk size, independent of the file size:
+class ChunkedPathInputData(PathInputData):
+    def __init__(self, path, chunk_size=1024 * 1024):
+        super().__init__(path)
+        self.chunk_size = chunk_size
+
+    def read_chunks(self):
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    @classmethod
+    def generate_inputs(cls, config):
+        data_dir = config['data_dir']
+        chunk_size = config.get('chunk_size', 1024 * 1024)
+        for name in os.listdir(data_dir):
+            yield cls(os.path.join(data_dir, name), chunk_size)
+
+class ChunkedLineCountWorker(GenericWorker):
+    def map(self):
+        self.result = sum(chunk.count(b'\n') for chunk in self.input_data.read_chunks())
+
+    def reduce(self, other):
+        self.result += other.result
+
+# Because the worker only relies on read_chunks, other inputs can provide the chunks differently. For example mmap
+# lets the operating system page the file in on demand, and bytes.count works directly on the mapped memory:
+import mmap
+
+class MmapPathInputData(ChunkedPathInputData):
+    def read_chunks(self):
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return  # Empty files can't be mapped
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for start in range(0, len(mapped), self.chunk_size):
+                    yield mapped[start:start + self.chunk_size]
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as tmpdir:
+        write_test_files(tmpdir)
+        config = {'data_dir': tmpdir, 'chunk_size': 16}
+        print('Chunked:', mapreduce(ChunkedLineCountWorker, ChunkedPathInputData, config, executor='process'))
+        print('Mapped:', mapreduce(ChunkedLineCountWorker, MmapPathInputData, config, executor='process'))
+
+# Chunked: 4950
+# Mapped: 4950
+
+
+# Input Splits
+# Creating one input per file skews the work whenever file sizes differ a lot: a single huge file keeps one worker busy
+# while the others are idle long before. Like Hadoop's input splits, a better input class cuts large files into byte
+# ranges and packs small files together, so every input covers roughly the same number of bytes. The ranges end right
+# after a newline, which keeps lines intact for workers that need whole records:
+class SplitInputData(GenericInputData):
+    def __init__(self, ranges, chunk_size=1024 * 1024):
+        super().__init__()
+        self.ranges = ranges  # List of (path, start, end) tuples
+        self.chunk_size = chunk_size
+
+    @property
+    def size(self):
+        return sum(end - start for _, start, end in self.ranges)
+
+    def read_chunks(self):
+        for path, start, end in self.ranges:
+            with open(path, 'rb') as f:
+                f.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    chunk = f.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+    @staticmethod
+    def split_file(path, split_size, chunk_size=1024 * 1024):
+        size = os.path.getsize(path)
+        start = 0
+        with open(path, 'rb') as f:
+            while size - start > split_size:
+                # Seeking one byte back makes a newline right before the offset count as the boundary. A file
+                # without newlines would make readline() load everything that's left, so scan in bounded chunks.
+                end = start + split_size - 1
+                f.seek(end)
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        end = size
+                        break
+                    newline = chunk.find(b'\n')
+                    if newline >= 0:
+                        end += newline + 1
+                        break
+                    end += len(chunk)
+                yield path, start, end
+                start = end
+        if start < size:
+            yield path, start, size
+
+    @classmethod
+    def generate_inputs(cls, config):
+        data_dir = config['data_dir']
+        split_size = config.get('split_size', 64 * 1024 * 1024)
+        chunk_size = config.get('chunk_size', 1024 * 1024)
+        pending, pending_size = [], 0
+        for name in sorted(os.listdir(data_dir)):
+            for path, start, end in cls.split_file(os.path.join(data_dir, name), split_size, chunk_size):
+                if pending and pending_size + end - start > split_size:
+                    yield cls(pending, chunk_size)
+                    pending, pending_size = [], 0
+                pending.append((path, start, end))
+                pending_size += end - start
+                if pending_size >= split_size:
+                    yield cls(pending, chunk_size)
+                    pending, pending_size = [], 0
+        if pending:
+            yield cls(pending, chunk_size)
+
+# ChunkedLineCountWorker works with these inputs unchanged, because it only relies on read_chunks. A directory with one
+# large file and the hundred small ones now results in evenly sized inputs:
+if __name__ == '__main__':
+    with TemporaryDirectory() as tmpdir:
+        write_test_files(tmpdir)
+        with open(os.path.join(tmpdir, 'large'), 'w') as f:
+            f.write('line\n' * 10000)
+        config = {'data_dir': tmpdir, 'split_size': 5000}
+        sizes = [data.size for data in SplitInputData.generate_inputs(config)]
+        print(len(sizes), 'splits between', min(sizes), 'and', max(sizes), 'bytes')
+        print('Split:', mapreduce(ChunkedLineCountWorker, SplitInputData, config, executor='process'))
+
+# 11 splits between 4950 and 5000 bytes
+# Split: 14950
+
+
+# Streaming and Tree Reduction
+# execute() only starts reducing after every map step has finished, and then reduces the results one by one. Since
+# the executors return futures, the workers can instead be reduced in the order in which they complete, so the reduce
+# step overlaps with the remaining map steps. If reduce is associative and commutative, finished workers can even be
+# combined pairwise on the pool, which turns the sequential reduction into a tree of logarithmic depth. Both variants
+# combine the workers in whatever order they happen to finish, so associativity alone is not enough: counting lines
+# is fine, concatenating results would come out shuffled. Batching several workers per future keeps the chunksize
+# option of Executor.map:
+from concurrent.futures import as_completed, wait, FIRST_COMPLETED
+
+def run_maps(batch):
+    return [run_map(worker) for worker in batch]
+
+def run_reduce(first, second):
+    first.reduce(second)
+    return first
+
+def execute(workers, executor='thread', max_workers=None, chunksize=1, tree_reduce=False):
+    with EXECUTORS[executor](max_workers=max_workers) as pool:
+        futures = [pool.submit(run_maps, workers[i:i + chunksize]) for i in range(0, len(workers), chunksize)]
+
+        if not tree_reduce:
+            first = None
+            for future in as_completed(futures):  # Completion order
+                for worker in future.result():
+                    if first is None:
+                        first = worker
+                    else:
+                        first.reduce(worker)
+            return first.result
+
+        pending, ready = set(futures), []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if isinstance(result, list):
+                    ready.extend(result)  # A batch of mapped workers
+                else:
+                    ready.append(result)  # A reduced pair
+            while len(ready) >= 2:
+                pending.add(pool.submit(run_reduce, ready.pop(), ready.pop()))
+        return ready[0].result
+
+def mapreduce(worker_class, input_class, config, executor='thread', max_workers=None, chunksize=1,
+              tree_reduce=False):
+    workers = worker_class.create_workers(input_class, config)
+    return execute(workers, executor=executor, max_workers=max_workers, chunksize=chunksize, tree_reduce=tree_reduce)
+
+# End-to-end latency is now bounded by the slowest batch of map steps plus a single reduce:
+if __name__ == '__main__':
+    with TemporaryDirectory() as tmpdir:
+        write_test_files(tmpdir)
+        config = {'data_dir': tmpdir, 'split_size': 500}
+        print('Streaming:', mapreduce(ChunkedLineCountWorker, SplitInputData, config, executor='process',
+                                      chunksize=4))
+        print('Tree:', mapreduce(ChunkedLineCountWorker, SplitInputData, config, executor='process', tree_reduce=True))
+
+# Streaming: 4950
+# Tree: 4950
+
+
+# Distributing Work over Sockets
+# Executors can only use the cores of a single machine. Because the workers are already plain objects with a map and a
+# reduce method, they can just as well be sent to worker processes on other hosts. multiprocessing.connection provides
+# the necessary building blocks: Listener and Client exchange length-prefixed, pickled messages over TCP or Unix
+# sockets and authenticate both ends with a shared key. Since unpickling a message can execute arbitrary code, the key
+# has to be a real secret, e.g. from os.urandom, and is shared with the worker processes out of band. A coordinator
+# hands out one worker at a time to every connected worker process, expects regular heartbeats while the map step runs
+# and puts the work back into the queue when a worker process disconnects or stays silent for too long:
+import time
+from multiprocessing import Process
+from multiprocessing.connection import Listener, Client
+from queue import Queue, Empty
+from threading import Event, Lock, Timer
+
+class Coordinator(object):
+    def __init__(self, authkey, address=('localhost', 0), heartbeat_timeout=5.0, reconnect_timeout=30.0):
+        self.listener = Listener(address, authkey=authkey)  # A str address uses a Unix socket
+        self.address = self.listener.address
+        self.heartbeat_timeout = heartbeat_timeout
+        self.reconnect_timeout = reconnect_timeout  # How long run waits for a worker process while none is connected
+        self.tasks = Queue()
+        self.results = Queue()
+        self.finished = Event()
+        self.lock = Lock()
+        self.connections = 0  # Worker processes currently connected
+        self.connected = False  # Whether any worker process has connected so far
+
+    def run(self, workers, timeout=None):
+        for task_id, worker in enumerate(workers):
+            self.tasks.put((task_id, worker))
+        Thread(target=self._accept, daemon=True).start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        first, completed = None, set()
+        idle_since = None  # Since when no worker process is connected
+        try:
+            while len(completed) < len(workers):
+                try:
+                    task_id, worker, error = self.results.get(timeout=0.1)
+                except Empty:
+                    now = time.monotonic()
+                    if deadline is not None and now > deadline:
+                        raise TimeoutError('%d of %d tasks unfinished' % (len(workers) - len(completed), len(workers)))
+                    with self.lock:
+                        idle = self.connected and not self.connections
+                    if not idle:
+                        idle_since = None
+                    elif idle_since is None:
+                        idle_since = now
+                    elif self.reconnect_timeout is not None and now - idle_since > self.reconnect_timeout:
+                        raise ConnectionError('No worker process connected for %.1f seconds' % (now - idle_since))
+                    continue
+                if error is not None:
+                    raise error
+                if task_id in completed:
+                    continue  # Late duplicate of a reassigned task
+                completed.add(task_id)
+                if first is None:
+                    first = worker
+                else:
+                    first.reduce(worker)
+        finally:
+            self.finished.set()
+            self.listener.close()
+        return first.result
+
+    def _accept(self):
+        while not self.finished.is_set():
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return  # Listener closed
+            except Exception:
+                continue  # E.g. failed authentication
+            with self.lock:
+                self.connections += 1
+                self.connected = True
+            Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            self._send_tasks(conn)
+        finally:
+            with self.lock:
+                self.connections -= 1
+
+    def _send_tasks(self, conn):
+        with conn:
+            while not self.finished.is_set():
+                try:
+                    task_id, worker = self.tasks.get(timeout=0.1)
+                except Empty:
+                    continue
+                try:
+                    conn.send(('map', task_id, worker))
+                    while True:
+                        if not conn.poll(self.heartbeat_timeout):
+                            raise TimeoutError('No heartbeat from worker')
+                        message = conn.recv()
+                        if message[0] != 'heartbeat':
+                            self.results.put((task_id,) + message[1:])
+                            break
+                except (EOFError, OSError):
+                    self.tasks.put((task_id, worker))  # Reassign to another worker process
+                    return
+            try:
+                conn.send(('stop',))
+            except OSError:
+                pass
+
+# The worker processes run the map step in a background thread and send heartbeats until it has finished:
+def serve_worker(address, authkey, heartbeat_interval=1.0):
+    with Client(address, authkey=authkey) as conn:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                return
+            if message[0] == 'stop':
+                return
+            _, task_id, worker = message
+            errors = []
+
+            def target():
+                try:
+                    worker.map()
+                except Exception as e:
+                    errors.append(e)
+
+            thread = Thread(target=target)
+            thread.start()
+            while True:
+                thread.join(heartbeat_interval)
+                if not thread.is_alive():
+                    break
+                conn.send(('heartbeat',))
+            conn.send(('result', worker, errors[0] if errors else None))
+
+# To span several machines, the coordinator listens on ('0.0.0.0', port) and serve_worker is started on every host
+# with the coordinator's address. The worker and input classes have to be importable there, because pickle only
+# transfers references to classes. Worker processes on different hosts rarely start at the same time, so run keeps
+# the remaining work queued when all of them have disconnected. Only if none connects again within reconnect_timeout
+# does it raise a ConnectionError instead of waiting forever, and the optional timeout bounds the whole job. On a
+# single host the whole protocol can be exercised with a few processes. Killing one of them while it holds work shows
+# that its task is reassigned, even to a worker process that only starts once the first one is gone:
+class SlowLineCountWorker(ChunkedLineCountWorker):
+    def map(self):
+        time.sleep(0.05)
+        super().map()
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as tmpdir:
+        write_test_files(tmpdir)
+        config = {'data_dir': tmpdir, 'split_size': 500}
+        workers = SlowLineCountWorker.create_workers(SplitInputData, config)
+        authkey = os.urandom(32)
+        coordinator = Coordinator(authkey, heartbeat_timeout=1.0)
+        processes = [Process(target=serve_worker, args=(coordinator.address, authkey),
+                             kwargs={'heartbeat_interval': 0.2})
+                     for _ in range(2)]
+        processes[0].start()
+        Timer(0.1, processes[0].terminate).start()
+        Timer(0.5, processes[1].start).start()  # Joins after the first one is gone
+        print('Distributed:', coordinator.run(workers, timeout=60))
+        for process in processes: process.join()
+
+# Distributed: 4950
+
+
+# Keyed Jobs with Combiner and Shuffle
+# So far every worker produces a single result. Many jobs are keyed instead, e.g. counting words or averaging grades
+# per student. Collecting all keys in one dictionary limits such jobs to what fits into memory. The classic solution
+# combines values per key on the map side, assigns each key to one of several partitions by hash and spills sorted runs
+# to disk whenever too many keys are buffered. The reduce phase then merges the sorted runs of each partition, which
+# only needs memory for one key at a time. Conveniently, merging the lists of runs fits the existing reduce method:
+import heapq
+import pickle
+import zlib
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+from tempfile import NamedTemporaryFile
+
+def partition_of(key, partitions):
+    # hash() of strings differs between processes, so use a stable checksum instead
+    return zlib.crc32(repr(key).encode()) % partitions
+
+def read_run(path):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+class KeyedWorker(GenericWorker):
+    def __init__(self, input_data, partitions=4, memory_limit=100000, spill_dir=None):
+        super().__init__(input_data)
+        self.partitions = partitions
+        self.memory_limit = memory_limit  # Maximum number of buffered keys
+        self.spill_dir = spill_dir
+        self.result = [[] for _ in range(partitions)]  # Sorted run files per partition
+
+    def map_pairs(self):
+        raise NotImplementedError
+
+    def combine(self, key, values):
+        raise NotImplementedError
+
+    def map(self):
+        buffer = {}
+        for key, value in self.map_pairs():
+            if key in buffer:
+                buffer[key] = self.combine(key, (buffer[key], value))
+            else:
+                buffer[key] = value
+                if len(buffer) >= self.memory_limit:
+                    self._spill(buffer)
+        self._spill(buffer)
+
+    def _spill(self, buffer):
+        partitioned = [[] for _ in range(self.partitions)]
+        for key, value in buffer.items():
+            partitioned[partition_of(key, self.partitions)].append((key, value))
+        for runs, items in zip(self.result, partitioned):
+            if not items:
+                continue
+            items.sort(key=itemgetter(0))
+            with NamedTemporaryFile('wb', suffix='.run', dir=self.spill_dir, delete=False) as f:
+                for item in items:
+                    pickle.dump(item, f)
+            runs.append(f.name)
+        buffer.clear()
+
+    def reduce(self, other):
+        for runs, other_runs in zip(self.result, other.result):
+            runs.extend(other_runs)
+
+    @classmethod
+    def create_workers(cls, input_class, config):
+        workers = []
+        for input_data in input_class.generate_inputs(config):
+            workers.append(cls(input_data, config.get('partitions', 4), config.get('memory_limit', 100000),
+                               config.get('spill_dir')))
+        return workers
+
+# Each partition is reduced independently, so the partitions can be processed on the pool as well. The reducers write
+# their output to disk again, and the final pairs are read back one at a time, so they never have to fit into memory
+# together either. keyed_mapreduce is a context manager: entering it runs the whole job, and leaving it removes the
+# output files, even if reading them fails or stops early:
+def reduce_partition(worker, runs):
+    merged = heapq.merge(*[read_run(path) for path in runs], key=itemgetter(0))
+    with NamedTemporaryFile('wb', suffix='.out', dir=worker.spill_dir, delete=False) as f:
+        for key, pairs in groupby(merged, key=itemgetter(0)):
+            pickle.dump((key, worker.combine(key, [value for _, value in pairs])), f)
+    for path in runs:
+        os.remove(path)
+    return f.name
+
+@contextmanager
+def keyed_mapreduce(worker_class, input_class, config, executor='thread', max_workers=None):
+    workers = worker_class.create_workers(input_class, config)
+    partitions = execute(workers, executor=executor, max_workers=max_workers)
+    with EXECUTORS[executor](max_workers=max_workers) as pool:
+        futures = [pool.submit(reduce_partition, workers[0], runs) for runs in partitions]
+    try:
+        paths = [future.result() for future in futures]  # Raises if a reducer failed
+        yield (pair for path in paths for pair in read_run(path))
+    finally:
+        for future in futures:
+            if future.exception() is None:
+                os.remove(future.result())
+
+# Keys have to be sortable, and for workers on several hosts spill_dir has to be shared storage. Counting words then
+# only requires the two keyed methods:
+class WordCountWorker(KeyedWorker):
+    def map_pairs(self):
+        for word in self.input_data.read().split():
+            yield word, 1
+
+    def combine(self, key, values):
+        return sum(values)
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as tmpdir, TemporaryDirectory() as spill_dir:
+        for i, text in enumerate(['to be or not to be', 'that is the question', 'to be is to do']):
+            with open(os.path.join(tmpdir, str(i)), 'w') as f:
+                f.write(text)
+        config = {'data_dir': tmpdir, 'partitions': 3, 'memory_limit': 2, 'spill_dir': spill_dir}
+        with keyed_mapreduce(WordCountWorker, PathInputData, config, executor='process') as counts:
+            print(heapq.nsmallest(4, counts, key=lambda item: (-item[1], item[0])))
+
+# [('to', 4), ('be', 3), ('is', 2), ('do', 1)]
+
+
+# Instrumentation
+# mapreduce only returns the final result, which tells nothing about where the time went. An optional stats object
+# can collect wall and CPU times per phase and per worker, bytes read, peak memory and a latency histogram. To keep the
+# measurements correct for process pools, the map and reduce steps time themselves and send the timings back along with
+# the worker:
+import json
+import statistics
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows
+
+def timed(kind, func, *args):
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    worker = func(*args)
+    return worker, kind, time.perf_counter() - start, time.thread_time() - cpu_start
+
+def input_size(input_data):
+    if hasattr(input_data, 'size'):
+        return input_data.size
+    if hasattr(input_data, 'path'):
+        return os.path.getsize(input_data.path)
+    return 0
+
+class MapReduceStats(object):
+    def __init__(self):
+        self.phases = {}
+        self.maps = []  # One dict per map step
+        self.reduces = []
+
+    @contextmanager
+    def phase(self, name):
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.phases[name] = {'wall': time.perf_counter() - start, 'cpu': time.process_time() - cpu_start}
+
+    def record(self, worker, kind, wall, cpu, index=None):
+        if kind == 'map':
+            # index is the position of the worker in the submitted list, the maps are recorded as they complete
+            self.maps.append({'worker': index, 'wall': wall, 'cpu': cpu, 'bytes': input_size(worker.input_data)})
+        else:
+            self.reduces.append({'wall': wall, 'cpu': cpu})
+        return worker
+
+    def histogram(self):
+        # Buckets of map latencies by powers of two in milliseconds
+        counts = {}
+        for entry in self.maps:
+            bucket = 1
+            while bucket < entry['wall'] * 1000:
+                bucket *= 2
+            counts[bucket] = counts.get(bucket, 0) + 1
+        return {'<=%dms' % bucket: counts[bucket] for bucket in sorted(counts)}
+
+    def stragglers(self, factor=2.0):
+        if not self.maps:
+            return []
+        median = statistics.median(entry['wall'] for entry in self.maps)
+        return sorted(entry['worker'] for entry in self.maps if entry['wall'] > factor * median)
+
+    def to_dict(self):
+        total_bytes = sum(entry['bytes'] for entry in self.maps)
+        execute_wall = self.phases.get('execute', {}).get('wall', 0)
+        return {
+            'phases': self.phases,
+            'workers': len(self.maps),
+            'map_wall': sum(entry['wall'] for entry in self.maps),
+            'map_cpu': sum(entry['cpu'] for entry in self.maps),
+            'reduce_wall': sum(entry['wall'] for entry in self.reduces),
+            'bytes_read': total_bytes,
+            'bytes_per_sec': total_bytes / execute_wall if execute_wall else 0,
+            'peak_rss_kb': resource and resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'peak_child_rss_kb': resource and resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            'latency_histogram': self.histogram(),
+            'stragglers': self.stragglers(),
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+# execute records every finished step. Both the streaming and the tree reduction are kept, the reduce steps simply go
+# through the same timing wrapper:
+def timed_maps(batch):
+    return [timed('map', run_map, worker) + (index,) for index, worker in batch]
+
+def execute(workers, executor='thread', max_workers=None, chunksize=1, tree_reduce=False, stats=None):
+    if stats is None:
+        stats = MapReduceStats()
+    with EXECUTORS[executor](max_workers=max_workers) as pool:
+        indexed = list(enumerate(workers))
+        pending = {pool.submit(timed_maps, indexed[i:i + chunksize]) for i in range(0, len(indexed), chunksize)}
+        ready = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if isinstance(result, list):
+                    ready.extend(stats.record(*timing) for timing in result)  # A batch of map steps
+                else:
+                    ready.append(stats.record(*result))  # A reduce step
+            while len(ready) >= 2:
+                first, second = ready.pop(), ready.pop()
+                if tree_reduce:
+                    pending.add(pool.submit(timed, 'reduce', run_reduce, first, second))
+                else:
+                    ready.append(stats.record(*timed('reduce', run_reduce, first, second)))
+        return ready[0].result
+
+def mapreduce(worker_class, input_class, config, executor='thread', max_workers=None, chunksize=1,
+              tree_reduce=False, stats=None):
+    if stats is None:
+        stats = MapReduceStats()
+    with stats.phase('generate_inputs'):
+        workers = worker_class.create_workers(input_class, config)
+    with stats.phase('execute'):
+        return execute(workers, executor=executor, max_workers=max_workers, chunksize=chunksize,
+                       tree_reduce=tree_reduce, stats=stats)
+
+# resource is only available on Unix, elsewhere the peak memory is reported as None. ru_maxrss is reported in
+# kilobytes on Linux (bytes on macOS). After a run, the stats can be dumped as JSON, e.g. to compare pool sizes or to
+# find the inputs that straggle. Map entries are recorded in completion order, so each one carries the index of its
+# worker in the list from create_workers, and stragglers returns these indexes:
+if __name__ == '__main__':
+    with TemporaryDirectory() as tmpdir:
+        write_test_files(tmpdir)
+        config = {'data_dir': tmpdir, 'split_size': 500}
+        stats = MapReduceStats()
+        print('Measured:', mapreduce(ChunkedLineCountWorker, SplitInputData, config, executor='process', stats=stats))
+        report = stats.to_dict()
+        print(report['workers'], 'workers read', report['bytes_read'], 'bytes')
+        print(sorted(report['phases']), sum(report['latency_histogram'].values()))
+
+# Measured: 4950
+# 11 workers read 4950 bytes
+# ['execute', 'generate_inputs'] 11
+# stats.to_json() gives the full report, e.g.:
+# {
+#   "phases": {"generate_inputs": {"wall": 0.0007, "cpu": 0.0007}, "execute": {"wall": 0.0215, "cpu": 0.0065}},
+#   "workers": 11, "map_wall": 0.0011, "map_cpu": 0.0009, "reduce_wall": 0.00001,
+#   "bytes_read": 4950, "bytes_per_sec": 230232.5, "peak_rss_kb": 17152, "peak_child_rss_kb": 15872,
+#   "latency_histogram": {"<=1ms": 11}, "stragglers": []
+# }
+
+
+# asyncio Inputs
+# Every blocking read costs one thread for as long as it waits, which is wasteful for slow I/O-bound sources like
+# network streams. With asyncio (see item 40 on coroutines) many sources can be read concurrently on one event loop. The
+# class hierarchy stays the same, only read and map become coroutines:
+import asyncio
+import multiprocessing
+
+class AsyncInputData(object):
+    async def read(self):
+        raise NotImplementedError
+
+    @classmethod
+    def generate_inputs(cls, config):
+        raise NotImplementedError
+
+class StreamInputData(AsyncInputData):
+    def __init__(self, host, port, request=b''):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.request = request
+
+    async def read(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(self.request)
+            writer.write_eof()
+            return await reader.read()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    @classmethod
+    def generate_inputs(cls, config):
+        for host, port, request in config['streams']:
+            yield cls(host, port, request)
+
+# CPU-heavy steps would block the event loop, so AsyncWorker offers to run them on an executor, ideally a process
+# pool. create_workers is inherited unchanged and reduce stays a plain method:
+class AsyncWorker(GenericWorker):
+    executor = None  # Set by async_mapreduce, None means the loop's default executor
+
+    async def map(self):
+        raise NotImplementedError
+
+    async def run_in_executor(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+def count_newlines(data):
+    return data.count(b'\n')
+
+class AsyncLineCountWorker(AsyncWorker):
+    async def map(self):
+        data = await self.input_data.read()
+        self.result = await self.run_in_executor(count_newlines, data)
+
+    def reduce(self, other):
+        self.result += other.result
+
+# async_mapreduce limits the number of concurrently mapped workers with a semaphore and reduces them as they complete:
+async def async_mapreduce(worker_class, input_class, config, concurrency=100, executor=None):
+    workers = worker_class.create_workers(input_class, config)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(worker):
+        async with semaphore:
+            worker.executor = executor
+            await worker.map()
+            return worker
+
+    first = None
+    for next_worker in asyncio.as_completed([run(worker) for worker in workers]):
+        worker = await next_worker
+        if first is None:
+            first = worker
+        else:
+            first.reduce(worker)
+    return first.result
+
+# A small server that answers every request with the requested number of newlines serves as the source here:
+async def serve_newlines(reader, writer):
+    count = int(await reader.read())
+    writer.write(b'\n' * count)
+    await writer.drain()
+    writer.close()
+
+async def count_stream_lines():
+    server = await asyncio.start_server(serve_newlines, 'localhost', 0)
+    port = server.sockets[0].getsockname()[1]
+    config = {'streams': [('localhost', port, str(i).encode()) for i in range(100)]}
+    async with server:
+        # The loop already runs threads, e.g. for name resolution, and forking a process while other threads hold
+        # locks can deadlock the child. Spawned processes start from scratch instead.
+        with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as pool:
+            return await async_mapreduce(AsyncLineCountWorker, StreamInputData, config,
+                                         concurrency=20, executor=pool)
+
+if __name__ == '__main__':
+    print('Streams:', asyncio.run(count_stream_lines()))
+
+# Streams: 4950
+
+
+# Timeouts, Retries and Speculative Execution
+# A single map step that hangs, e.g. because of a failing disk, keeps execute waiting forever and a few slow ones
+# dominate the total runtime. The pools already balance the load dynamically, since idle workers take the next task
+# from the shared queue. A scheduler on top can additionally watch the running tasks: it retries tasks that raise or
+# exceed a timeout a bounded number of times, and once half of the tasks have finished, it starts a second copy of any
+# task that runs longer than a percentile of the finished ones. Whichever copy finishes first wins. Every attempt maps
+# its own copy of the worker, so the copies don't interfere:
+import copy
+
+class Scheduler(object):
+    def __init__(self, executor='thread', max_workers=None, timeout=None, retries=2,
+                 percentile=0.9, slowdown=1.5, poll_interval=0.05):
+        self.executor = executor
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.percentile = percentile
+        self.slowdown = slowdown
+        self.poll_interval = poll_interval
+
+    def execute(self, workers):
+        # Attempts that time out or lose against their speculative copy are abandoned. With the process executor,
+        # the processes still running them are terminated at the end. Threads can't be stopped: with the thread
+        # executor an abandoned attempt keeps its thread busy, and one that never returns blocks the interpreter from
+        # exiting, since the pool's threads are joined at exit. Tasks that may hang need the process executor.
+        pool = EXECUTORS[self.executor](max_workers=self.max_workers)
+        attempts, abandoned = {}, []
+        try:
+            mapped = self._map(pool, workers, attempts, abandoned)
+        finally:
+            # ProcessPoolExecutor has no public way to stop its processes, and shutdown forgets them
+            processes = list((getattr(pool, '_processes', None) or {}).values())
+            pool.shutdown(wait=False, cancel_futures=True)  # Don't wait for abandoned attempts
+            if any(not future.done() for future in abandoned + list(attempts)):
+                for process in processes:
+                    process.terminate()
+        first, rest = mapped[0], mapped[1:]
+        for worker in rest:
+            first.reduce(worker)
+        return first.result
+
+    def _map(self, pool, workers, attempts, abandoned):
+        # attempts maps each running future to [index, start time], abandoned collects the futures given up on
+        failures = [0] * len(workers)
+        results = [None] * len(workers)
+        durations = []
+        speculated = set()
+
+        def launch(index):
+            future = pool.submit(run_map, copy.copy(workers[index]))
+            attempts[future] = [index, None]
+
+        def discard(future):
+            del attempts[future]
+            if not future.cancel():
+                abandoned.append(future)  # Already running, it has to be stopped at the end
+
+        def fail(index, error):
+            failures[index] += 1
+            if failures[index] > self.retries:
+                raise error
+            if index not in (i for i, _ in attempts.values()):
+                launch(index)
+
+        for index in range(len(workers)):
+            launch(index)
+
+        while len(durations) < len(workers):
+            done, _ = wait(attempts, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in done:
+                index, started = attempts.pop(future)
+                if results[index] is not None:
+                    continue  # The other copy was faster
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    fail(index, e)
+                    continue
+                durations.append(now - (started or now))
+                for other, (other_index, _) in list(attempts.items()):
+                    if other_index == index:
+                        discard(other)  # The slower copy
+
+            threshold = None
+            if len(durations) * 2 >= len(workers):
+                ordered = sorted(durations)
+                threshold = ordered[int(self.percentile * (len(ordered) - 1))] * self.slowdown
+
+            for future, attempt in list(attempts.items()):
+                index, started = attempt
+                if started is None:
+                    if future.running():
+                        attempt[1] = now  # Queued tasks don't count towards the timeout
+                    continue
+                if results[index] is not None:
+                    discard(future)
+                elif self.timeout is not None and now - started > self.timeout:
+                    discard(future)
+                    fail(index, TimeoutError('Task %d timed out' % index))
+                elif threshold is not None and index not in speculated and now - started > threshold:
+                    speculated.add(index)
+                    launch(index)
+        return results
+
+# Until the scheduler finishes, abandoned attempts keep occupying their thread or process, so the pool needs enough
+# workers to run the retries next to them. Here one input is very slow on its first attempt and another one fails once:
+class UnreliableLineCountWorker(ChunkedLineCountWorker):
+    behavior = None
+    attempted = set()  # Shared by all threads
+
+    def map(self):
+        first_attempt = id(self.input_data) not in self.attempted
+        self.attempted.add(id(self.input_data))
+        if first_attempt and self.behavior == 'fail':
+            raise IOError('Read error')
+        time.sleep(1.0 if first_attempt and self.behavior == 'hang' else 0.01)
+        super().map()
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as tmpdir:
+        write_test_files(tmpdir)
+        config = {'data_dir': tmpdir, 'split_size': 500}
+        scheduler = Scheduler(max_workers=4, timeout=5.0)
+        start = time.monotonic()
+        workers = UnreliableLineCountWorker.create_workers(SplitInputData, config)
+        workers[0].behavior = 'fail'
+        workers[-1].behavior = 'hang'
+        result = scheduler.execute(workers)
+        print('Scheduled:', result, 'lines in under half a second:', time.monotonic() - start < 0.5)
+
+# Scheduled: 4950 lines in under half a second: True
+
+
+# Caching Results
+# When the same directory is processed again and again, most files haven't changed since the last run. Because each
+# worker maps exactly one input, its result can be cached on disk under the worker class and the input path. The size
+# and modification time detect changes cheaply. Optionally a content hash is compared when they differ, which avoids
+# recomputing files that were only touched or copied. The shelve module provides the persistent dictionary:
+import hashlib
+import shelve
+from itertools import repeat
+
+def run_cached_map(worker, content_hash):
+    # The entry has to describe the file as it was read by map, so stat and hash it right before, in the same task
+    path = worker.input_data.path
+    stat = os.stat(path)
+    digest = ResultCache.digest(path) if content_hash else None
+    worker.map()
+    return worker.result, stat.st_size, stat.st_mtime_ns, digest
+
+class ResultCache(object):
+    def __init__(self, path, content_hash=False):
+        self.path = path
+        self.content_hash = content_hash
+        self.recomputed = 0
+
+    @staticmethod
+    def digest(path):
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _lookup(self, db, key, path, stat):
+        entry = db.get(key)
+        if entry is None:
+            return False, None
+        size, mtime, digest, result = entry
+        if (size, mtime) == (stat.st_size, stat.st_mtime_ns):
+            return True, result
+        if self.content_hash and size == stat.st_size and digest == self.digest(path):
+            db[key] = (size, stat.st_mtime_ns, digest, result)
+            return True, result
+        return False, None
+
+    def execute(self, workers, executor='thread', max_workers=None):
+        with shelve.open(self.path) as db:
+            misses = []
+            for worker in workers:
+                cls, path = type(worker), worker.input_data.path
+                key = '%s.%s:%s' % (cls.__module__, cls.__qualname__, os.path.abspath(path))
+                found, result = self._lookup(db, key, path, os.stat(path))
+                if found:
+                    worker.result = result
+                else:
+                    misses.append((key, worker))
+
+            with EXECUTORS[executor](max_workers=max_workers) as pool:
+                mapped = pool.map(run_cached_map, [worker for _, worker in misses], repeat(self.content_hash))
+                for (key, worker), (result, size, mtime, digest) in zip(misses, mapped):
+                    db[key] = (size, mtime, digest, result)
+                    worker.result = result
+        self.recomputed = len(misses)
+
+        first, rest = workers[0], workers[1:]
+        for worker in rest:
+            first.reduce(worker)
+        return first.result
+
+# Without content_hash, a file rewritten with the same size within the timestamp resolution of the file system goes
+# unnoticed. Only changed files are mapped again on the following runs:
+if __name__ == '__main__':
+    with TemporaryDirectory() as tmpdir, TemporaryDirectory() as cache_dir:
+        write_test_files(tmpdir)
+        config = {'data_dir': tmpdir}
+        cache = ResultCache(os.path.join(cache_dir, 'results'), content_hash=True)
+        for change in [None, None, '42']:
+            if change:
+                with open(os.path.join(tmpdir, change), 'a') as f:
+                    f.write('\n')
+            workers = LineCountWorker.create_workers(PathInputData, config)
+            result = cache.execute(workers, executor='process')
+            print('Cached:', result, 'lines,', cache.recomputed, 'recomputed')
 
+# Cached: 4950 lines, 100 recomputed
+# Cached: 4950 lines, 0 recomputed
+# Cached: 4951 lines, 1 recomputed
@@ -9,6 +9,8 @@ import json
 
 
 class ToDictMixin(object):
+    __slots__ = ()
+
     def to_dict(self):
         return self._traverse_dict(self.__dict__)
 
@@ -22,7 +24,7 @@ class ToDictMixin(object):
         if isinstance(value, ToDictMixin):
             return value.to_dict()
         elif isinstance(value, dict):
-            return self._traverse(dict)
+            return self._traverse_dict(value)
         elif isinstance(value, list):
             return [self._traverse(key, i) for i in value]
         elif hasattr(value, '__dict__'):
@@ -128,3 +130,553 @@ roundtrip = deserialized.to_json()
 assert json.loads(serialized) == json.loads(roundtrip)
 
 
+
+
+# Compiling Serializers per Class
+# ToDictMixin decides how to convert each attribute with a chain of isinstance checks, on every call and for every
+# attribute of every object. But how a value is converted only depends on its class. A faster mix-in can therefore
+# compile a serializer function per class on first use and cache it, so that converting an attribute boils down to a
+# dictionary lookup and a call. The serializers for objects also collect the names from __slots__, since objects of
+# such classes have no __dict__ and ToDictMixin would skip their attributes:
+ATOMIC_TYPES = (str, int, float, bool, type(None))
+
+class FastToDictMixin(ToDictMixin):
+    __slots__ = ()
+    _serializers = {}  # value type -> function converting values of that type
+    _attribute_serializers = {}  # class -> function converting the attributes of its instances
+
+    def to_dict(self):
+        return attribute_serializer_for(type(self))(self)
+
+def serializer_for(value_type):
+    serializer = FastToDictMixin._serializers.get(value_type)
+    if serializer is None:
+        serializer = FastToDictMixin._serializers[value_type] = compile_serializer(value_type)
+    return serializer
+
+def attribute_serializer_for(cls):
+    serializer = FastToDictMixin._attribute_serializers.get(cls)
+    if serializer is None:
+        serializer = FastToDictMixin._attribute_serializers[cls] = compile_attribute_serializer(cls)
+    return serializer
+
+def slot_names(cls):
+    names = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        for name in [slots] if isinstance(slots, str) else slots:
+            if name in ('__dict__', '__weakref__'):
+                continue
+            if name.startswith('__') and not name.endswith('__'):
+                name = '_%s%s' % (klass.__name__.lstrip('_'), name)  # Private name mangling
+            names.append(name)
+    return names
+
+def compile_serializer(value_type):
+    if issubclass(value_type, ATOMIC_TYPES):
+        return lambda value: value
+    if issubclass(value_type, dict):
+        return lambda value: {key: serializer_for(type(item))(item) for key, item in value.items()}
+    if issubclass(value_type, list):
+        return lambda value: [serializer_for(type(item))(item) for item in value]
+    if issubclass(value_type, ToDictMixin) and value_type.to_dict is not FastToDictMixin.to_dict:
+        return compile_to_dict_serializer(value_type)  # Plain ToDictMixin or a custom to_dict
+    if not slot_names(value_type) and value_type.__dictoffset__ == 0:
+        return lambda value: value
+    return compile_attribute_serializer(value_type, nested=True)
+
+# Assigning new bases to a class replaces its method resolution order by a new tuple, so checking its identity is a
+# cheap way to notice that a serializer is outdated. The same goes for replacing _traverse or to_dict at runtime. An
+# outdated serializer removes itself from the caches and hands the value to a freshly compiled one:
+def outdated(cls):
+    FastToDictMixin._serializers.pop(cls, None)
+    FastToDictMixin._attribute_serializers.pop(cls, None)
+
+def compile_to_dict_serializer(value_type):
+    mro, traverse, to_dict = value_type.__mro__, getattr(value_type, '_traverse', None), value_type.to_dict
+
+    def serialize(value):
+        cls = type(value)
+        if cls.__mro__ is not mro or getattr(cls, '_traverse', None) is not traverse or cls.to_dict is not to_dict:
+            outdated(cls)
+            return serializer_for(cls)(value)
+        return to_dict(value)
+
+    return serialize
+
+# A class's own to_dict always uses the attribute serializer, so an overridden to_dict can call super().to_dict()
+# without being dispatched back to itself. Only nested values go through serializer_for, whose cache holds a second
+# attribute serializer that hands outdated values to serializer_for again:
+def compile_attribute_serializer(value_type, nested=False):
+    slots = slot_names(value_type)
+    has_dict = value_type.__dictoffset__ != 0  # Whether instances have a __dict__
+    if not slots and not has_dict:
+        return lambda value: {}
+
+    mro, to_dict = value_type.__mro__, getattr(value_type, 'to_dict', None)
+    traverse = getattr(value_type, '_traverse', ToDictMixin._traverse)
+    custom = traverse is not ToDictMixin._traverse
+    serializers = FastToDictMixin._serializers
+    recompile = serializer_for if nested else attribute_serializer_for
+    atomic = set(ATOMIC_TYPES)  # Exact types, subclasses take the slower path
+
+    def serialize(obj):
+        cls = type(obj)
+        if (cls.__mro__ is not mro or getattr(cls, '_traverse', ToDictMixin._traverse) is not traverse or
+                getattr(cls, 'to_dict', None) is not to_dict):
+            outdated(cls)
+            return recompile(cls)(obj)
+        if slots:
+            items = [(name, getattr(obj, name)) for name in slots if hasattr(obj, name)]
+            if has_dict:
+                items.extend(obj.__dict__.items())
+        else:
+            items = obj.__dict__.items()
+        if custom:
+            return {key: obj._traverse(key, value) for key, value in items}
+        output = {}
+        for key, value in items:
+            value_type = type(value)
+            if value_type in atomic:
+                output[key] = value
+            else:
+                output[key] = (serializers.get(value_type) or serializer_for(value_type))(value)
+        return output
+
+    return serialize
+
+# Existing classes can switch to the fast mix-in by listing it first. Classes that override _traverse, like
+# BinaryTreeWithParent, still get their hook called for every attribute. Both mix-ins declare empty __slots__,
+# otherwise every subclass would get a __dict__ even if it lists its own __slots__:
+class FastBinaryTree(FastToDictMixin, BinaryTree):
+    pass
+
+class FastBinaryTreeWithParent(FastToDictMixin, BinaryTreeWithParent):
+    pass
+
+class Point(FastToDictMixin):
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+point = Point(1, 2)
+print(point.to_dict(), hasattr(point, '__dict__'))
+root = FastBinaryTreeWithParent(10)
+root.left = FastBinaryTreeWithParent(7, parent=root)
+print(root.to_dict())
+
+# {'x': 1, 'y': 2} False
+# {'value': 10, 'left': {'value': 7, 'left': None, 'right': None, 'parent': 10}, 'right': None, 'parent': None}
+
+# Subclasses can still extend the conversion by overriding to_dict:
+class LabeledPoint(Point):
+    __slots__ = ('label',)
+
+    def __init__(self, x, y, label):
+        super().__init__(x, y)
+        self.label = label
+
+    def to_dict(self):
+        output = super().to_dict()
+        output['label'] = output['label'].upper()
+        return output
+
+print(LabeledPoint(3, 4, 'a').to_dict(), Point(LabeledPoint(3, 4, 'a'), None).to_dict())
+
+# {'x': 3, 'y': 4, 'label': 'A'} {'x': {'x': 3, 'y': 4, 'label': 'A'}, 'y': None}
+
+# For a larger tree the cached serializers pay off:
+import timeit
+
+def build_tree(tree_class, depth):
+    if not depth:
+        return None
+    return tree_class(depth, left=build_tree(tree_class, depth - 1), right=build_tree(tree_class, depth - 1))
+
+slow_tree, fast_tree = build_tree(BinaryTree, 14), build_tree(FastBinaryTree, 14)
+assert slow_tree.to_dict() == fast_tree.to_dict()
+print('ToDictMixin: %.3fs' % min(timeit.repeat(slow_tree.to_dict, number=5, repeat=3)))
+print('FastToDictMixin: %.3fs' % min(timeit.repeat(fast_tree.to_dict, number=5, repeat=3)))
+
+# ToDictMixin: 0.075s
+# FastToDictMixin: 0.050s
+
+
+# Iterative and Cycle-Safe Traversal
+# Both mix-ins recurse once per level of nesting, so very deep object graphs raise a RecursionError, and cycles have to
+# be broken by hand like in BinaryTreeWithParent. A traversal with an explicit stack has no depth limit. By remembering
+# the ids of the objects it is currently inside of, it detects any cycle and emits a reference instead, i.e.
+# {'$ref': n}, with the referenced object marked by '$id': n. Optionally the same is done for every object that has
+# already been converted, so objects shared in several places appear only once and the output stays linear in the
+# number of unique objects. Lists and dicts can't carry an '$id', so a list or dict that contains itself raises a
+# ValueError, like it does in the json module. Nested objects that customize to_dict or _traverse are converted by
+# their own to_dict, so their hooks keep working. A class that overrides _traverse itself is converted by the
+# recursive ToDictMixin.to_dict, since only that calls the hook for every attribute:
+_EXIT = object()
+
+class IterativeToDictMixin(ToDictMixin):
+    __slots__ = ()
+
+    def to_dict(self, share_references=False):
+        if type(self)._traverse is not ToDictMixin._traverse:
+            return ToDictMixin.to_dict(self)  # The hook decides how each attribute is converted
+        generic = (ToDictMixin.to_dict, FastToDictMixin.to_dict, IterativeToDictMixin.to_dict)
+        root = {}
+        stack = [(root, 'root', self)]
+        outputs = {}  # id -> output dict of every converted object
+        active = set()  # ids of the objects currently being converted
+        references = {}  # id -> reference number
+
+        def reference(obj_id):
+            if obj_id not in references:
+                references[obj_id] = len(references) + 1
+                outputs[obj_id]['$id'] = references[obj_id]
+            return {'$ref': references[obj_id]}
+
+        while stack:
+            target, key, value = stack.pop()
+            if target is _EXIT:
+                active.discard(key)
+                continue
+            if type(value) in ATOMIC_TYPES:
+                target[key] = value
+            elif isinstance(value, (list, dict)):
+                if id(value) in active:
+                    raise ValueError('Circular reference detected')
+                active.add(id(value))
+                stack.append((_EXIT, id(value), None))
+                if isinstance(value, list):
+                    target[key] = [None] * len(value)
+                    stack.extend((target[key], i, value[i]) for i in reversed(range(len(value))))
+                else:
+                    target[key] = dict.fromkeys(value)  # Keeps the order of the keys
+                    stack.extend((target[key], name, item) for name, item in reversed(value.items()))
+            elif value is not self and isinstance(value, ToDictMixin) and (
+                    type(value).to_dict not in generic or type(value)._traverse is not ToDictMixin._traverse):
+                target[key] = value.to_dict()
+            else:
+                slots = slot_names(type(value))
+                if not slots and not hasattr(value, '__dict__'):
+                    target[key] = value
+                    continue
+                obj_id = id(value)
+                if obj_id in active or share_references and obj_id in outputs:
+                    target[key] = reference(obj_id)
+                    continue
+                items = [(name, getattr(value, name)) for name in slots if hasattr(value, name)]
+                items.extend(getattr(value, '__dict__', {}).items())
+                target[key] = outputs[obj_id] = dict.fromkeys(name for name, _ in items)
+                active.add(obj_id)
+                stack.append((_EXIT, obj_id, None))
+                stack.extend((target[key], name, item) for name, item in reversed(items))  # First on top
+        return root['root']
+
+# The mix-in walks all attributes itself, so _traverse overrides are no longer needed to break cycles:
+class LinkedTree(IterativeToDictMixin):
+    def __init__(self, value, left=None, right=None, parent=None):
+        self.value = value
+        self.left = left
+        self.right = right
+        self.parent = parent
+
+root = LinkedTree(10)
+root.left = LinkedTree(7, parent=root)
+root.left.right = LinkedTree(9, parent=root.left)
+print(root.to_dict())
+
+# {'value': 10, 'left': {'value': 7, 'left': None, 'right': {'value': 9, 'left': None, 'right': None,
+# 'parent': {'$ref': 1}}, 'parent': {'$ref': 2}, '$id': 1}, 'right': None, 'parent': None, '$id': 2}
+
+shared = LinkedTree(1)
+pair = LinkedTree(0, left=shared, right=shared)
+print(pair.to_dict(), pair.to_dict(share_references=True), sep='\n')
+
+# {'value': 0, 'left': {'value': 1, 'left': None, 'right': None, 'parent': None},
+# 'right': {'value': 1, 'left': None, 'right': None, 'parent': None}, 'parent': None}
+# {'value': 0, 'left': {'value': 1, 'left': None, 'right': None, 'parent': None, '$id': 1}, 'right': {'$ref': 1},
+# 'parent': None}
+
+deep = LinkedTree(0)
+for i in range(1, 100000):
+    deep = LinkedTree(i, left=deep)
+    deep.left.parent = deep
+print('Converted a tree of depth', deep.to_dict()['value'] + 1)
+
+# Converted a tree of depth 100000
+
+custom = BinaryTreeWithParent(5)
+custom.left = BinaryTreeWithParent(3, parent=custom)
+print(LinkedTree(1, left=custom).to_dict())
+cyclic = []
+cyclic.append(cyclic)
+try:
+    LinkedTree(cyclic).to_dict()
+except ValueError as e:
+    print('ValueError:', e)
+
+# {'value': 1, 'left': {'value': 5, 'left': {'value': 3, 'left': None, 'right': None, 'parent': 5}, 'right': None,
+# 'parent': None}, 'right': None, 'parent': None}
+# ValueError: Circular reference detected
+
+# Subclasses can override either method like with the other mix-ins:
+class IterativeTreeWithParent(IterativeToDictMixin, BinaryTreeWithParent):
+    pass
+
+class CountedTree(LinkedTree):
+    def to_dict(self, share_references=False):
+        output = super().to_dict(share_references)
+        output['size'] = 1 + sum(child.to_dict()['size'] for child in (self.left, self.right) if child)
+        return output
+
+root = IterativeTreeWithParent(10)
+root.left = IterativeTreeWithParent(7, parent=root)
+print(root.to_dict())
+print(CountedTree(2, left=CountedTree(1)).to_dict())
+
+# {'value': 10, 'left': {'value': 7, 'left': None, 'right': None, 'parent': 10}, 'right': None, 'parent': None}
+# {'value': 2, 'left': {'value': 1, 'left': None, 'right': None, 'parent': None, 'size': 1}, 'right': None,
+# 'parent': None, 'size': 2}
+
+
+# Streaming JSON
+# JsonMixin.to_json first builds the complete dictionary representation and then encodes it into one string, so the
+# data is held in memory in several copies at once. The json module can also encode incrementally: iterencode yields
+# the output in small pieces and calls a default hook for every object it doesn't know. If that hook returns the
+# attributes of an object, nested objects are only visited when the encoder gets to them, and no intermediate
+# dictionaries are built at all. Collecting the pieces up to a buffer size keeps the number of writes low:
+GENERIC_TO_DICT = (ToDictMixin.to_dict, FastToDictMixin.to_dict)  # The encoder can walk the attributes itself
+
+def json_attributes(obj):
+    cls = type(obj)
+    if (getattr(cls, '_traverse', ToDictMixin._traverse) is not ToDictMixin._traverse or
+            getattr(cls, 'to_dict', ToDictMixin.to_dict) not in GENERIC_TO_DICT):
+        return obj.to_dict()  # Custom or iterative conversions, e.g. with references for cycles
+    slots = slot_names(type(obj))
+    if slots:
+        attributes = {name: getattr(obj, name) for name in slots if hasattr(obj, name)}
+        attributes.update(getattr(obj, '__dict__', {}))
+        return attributes
+    if hasattr(obj, '__dict__'):
+        return obj.__dict__
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+class StreamingJsonMixin(JsonMixin):
+    def iter_json(self, buffer_size=64 * 1024):
+        encoder = json.JSONEncoder(default=json_attributes)
+        buffer, size = [], 0
+        for chunk in encoder.iterencode(self):
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= buffer_size:
+                yield ''.join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield ''.join(buffer)
+
+    def to_json_stream(self, fp, buffer_size=64 * 1024):
+        for chunk in self.iter_json(buffer_size):
+            fp.write(chunk)
+
+# Objects whose classes customize the conversion, including IterativeToDictMixin with its references for cycles, are
+# still converted by their to_dict, so streaming them saves no memory. Like json.dumps in to_json, the encoder recurses
+# once per level of nesting. It works for the existing classes without any changes, e.g. for the datacenter rack:
+class StreamingDatacenterRack(StreamingJsonMixin, DatacenterRack):
+    pass
+
+class StreamingCountedTree(StreamingJsonMixin, CountedTree):
+    pass
+
+class StreamingLinkedTree(StreamingJsonMixin, LinkedTree):
+    pass
+
+rack = StreamingDatacenterRack.from_json(serialized)
+assert json.loads(''.join(rack.iter_json())) == json.loads(serialized)
+counted = StreamingCountedTree(2, left=CountedTree(1))
+assert json.loads(''.join(counted.iter_json())) == json.loads(counted.to_json())
+linked = StreamingLinkedTree(2)
+linked.left = LinkedTree(1, parent=linked)  # A cycle, resolved by a reference
+assert json.loads(''.join(linked.iter_json())) == json.loads(linked.to_json())
+
+# Exporting a large inventory to a file shows the difference in peak memory usage:
+import os
+import tracemalloc
+
+def peak_memory(func):
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+rack = StreamingDatacenterRack(switch={'ports': 5, 'speed': 1e9},
+                               machines=[{'cores': 8, 'ram': 32e9, 'disk': 5e12}] * 100000)
+with open(os.devnull, 'w') as f:
+    print('to_json: %.1f MB' % peak_memory(lambda: f.write(rack.to_json())))
+    print('to_json_stream: %.1f MB' % peak_memory(lambda: rack.to_json_stream(f)))
+
+# to_json: 36.0 MB
+# to_json_stream: 0.6 MB
+
+# The price is speed: iterencode can't use the C accelerator of the json module, so encoding takes about five times
+# longer.
+
+
+# Schema-Driven Deserialization
+# JsonMixin.from_json relies on the constructor to build the nested objects, like DatacenterRack does for its switch
+# and machines. Every nested object is built right away, even if it is never used. If a class declares in a schema
+# which attributes hold nested objects, a deserializer can do that work itself. Since JsonMixin already requires the
+# constructor arguments to match the attributes, it can skip __init__ and use the decoded dictionary as the instance
+# dictionary, so from_dict takes ownership of the data passed to it. The constructor function compiled from the schema
+# is cached per class. In lazy mode, lists of nested objects are only converted item by item when they are accessed:
+class LazyList(list):
+    # Holds the decoded dictionaries until an item is accessed. Indexing, iteration and pop convert single items, the
+    # list methods and operators that look at all items, like comparisons, +, count or sort, convert all of them
+    # first. Code that reads the storage of a list directly without going through these methods still sees the
+    # dictionaries, e.g. assigning a LazyList to a slice of another list.
+    def __init__(self, items, convert):
+        super().__init__(items)
+        self._convert = convert
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        item = super().__getitem__(index)
+        if type(item) is dict:
+            item = self._convert(item)
+            super().__setitem__(index, item)
+        return item
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __reversed__(self):
+        for i in reversed(range(len(self))):
+            yield self[i]
+
+    def __radd__(self, other):
+        # list has no __radd__, so [] + lazy_list would copy the dictionaries without this
+        if not isinstance(other, list):
+            return NotImplemented
+        return other + list(self)
+
+    def pop(self, index=-1):
+        item = self[index]
+        super().pop(index)
+        return item
+
+    def convert_all(self):
+        for i in range(len(self)):
+            self[i]
+
+def converting(method):
+    def wrapper(*args, **kwargs):
+        for arg in args:
+            if isinstance(arg, LazyList):
+                arg.convert_all()
+        return method(*args, **kwargs)
+    return wrapper
+
+for name in ('__contains__', '__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__', '__add__', '__mul__',
+             '__rmul__', '__repr__', 'copy', 'count', 'index', 'remove', 'sort'):
+    setattr(LazyList, name, converting(getattr(list, name)))
+
+class SchemaJsonMixin(JsonMixin):
+    json_schema = {}  # attribute name -> class, or [class] for lists
+    _constructors = {}  # class -> function building an instance from decoded data
+
+    @classmethod
+    def from_dict(cls, data, lazy=False):
+        construct = SchemaJsonMixin._constructors.get(cls) or cls._compile_constructor()
+        return construct(data, lazy)
+
+    @classmethod
+    def _compile_constructor(cls):
+        fields = []
+        for name, item_class in cls.json_schema.items():
+            is_list = isinstance(item_class, list)
+            if is_list:
+                item_class = item_class[0]
+            if hasattr(item_class, 'from_dict'):
+                converter = item_class.from_dict
+            else:
+                converter = lambda data, lazy, item_class=item_class: item_class(**data)
+            fields.append((name, converter, is_list))
+
+        def construct(data, lazy):
+            for name, converter, is_list in fields:
+                value = data.get(name)
+                if value is None:
+                    continue
+                if not is_list:
+                    data[name] = converter(value, lazy)
+                elif lazy:
+                    data[name] = LazyList(value, lambda item, converter=converter: converter(item, True))
+                else:
+                    data[name] = [converter(item, False) for item in value]
+            obj = cls.__new__(cls)
+            obj.__dict__ = data  # Takes over the decoded dictionary instead of copying it
+            return obj
+
+        SchemaJsonMixin._constructors[cls] = construct
+        return construct
+
+    @classmethod
+    def from_json(cls, data, lazy=False):
+        return cls.from_dict(json.loads(data), lazy)
+
+    @classmethod
+    def from_json_lines(cls, lines, lazy=False):
+        objects = []
+        for index, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                raise ValueError('Line %d: %s' % (index + 1, e)) from e
+            objects.append(cls.from_dict(data, lazy))
+        return objects
+
+# The existing datacenter classes only need a schema:
+class SchemaSwitch(SchemaJsonMixin, Switch):
+    pass
+
+class SchemaMachine(SchemaJsonMixin, Machine):
+    pass
+
+class SchemaDatacenterRack(SchemaJsonMixin, DatacenterRack):
+    json_schema = {'switch': SchemaSwitch, 'machines': [SchemaMachine]}
+
+rack = SchemaDatacenterRack.from_json(serialized, lazy=True)
+print(type(rack.switch).__name__, type(list.__getitem__(rack.machines, 0)).__name__)
+print(rack.machines[0].cores, type(rack.machines[0]).__name__)
+assert json.loads(rack.to_json()) == json.loads(serialized)
+
+# SchemaSwitch dict
+# 8 SchemaMachine
+
+# Other ways of getting at the machines convert them too, only their number is known without converting anything:
+rack = SchemaDatacenterRack.from_json(serialized, lazy=True)
+print(type(rack.machines.pop()).__name__, type(next(reversed(rack.machines))).__name__, len(rack.machines))
+
+# SchemaMachine SchemaMachine 2
+
+# Loading many racks while touching only a few fields is where the lazy mode pays off:
+lines = [json.dumps({'switch': {'ports': 5, 'speed': 1e9},
+                     'machines': [{'cores': 8, 'ram': 32e9, 'disk': 5e12}] * 100})] * 1000
+for name, load in [('from_json', lambda: [DatacenterRack.from_json(line) for line in lines]),
+                   ('from_json_lines', lambda: SchemaDatacenterRack.from_json_lines(lines)),
+                   ('from_json_lines lazy', lambda: SchemaDatacenterRack.from_json_lines(lines, lazy=True))]:
+    seconds = min(timeit.repeat(lambda: [rack.switch.ports for rack in load()], number=1, repeat=3))
+    print('%s: %.3fs' % (name, seconds))
+
+# from_json: 0.118s
+# from_json_lines: 0.120s
+# from_json_lines lazy: 0.073s
+
+# Eagerly building all objects costs about the same either way, so the eager mode gains nothing over calling from_json
+# for every line. Skipping the machines nobody looks at saves a third of the time, the rest is spent in the JSON
+# parser, which always has to decode the complete documents.
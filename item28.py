@@ -113,3 +113,678 @@ print('Count of 10 is', tree.count(10))
 # The benefit of this approach is even larger for classes that need more methods to match Python conventions, like
 # Set and MutableMapping.
 
+
+
+# Indexing by Subtree Size
+# Each tree[i] call above searches in-order from the root, so indexing is O(n) and list(tree), which indexes every
+# position in turn, is O(n^2). If each node additionally stores the size of its subtree, the index can be found by
+# descending along a single path, comparing with the size of the left subtree at each step:
+class SizedNode(BetterNode):
+    def __init__(self, value, left=None, right=None):
+        super().__init__(value, left=left, right=right)
+        self.size = 1 + _size(left) + _size(right)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('Index out of range')
+        node = self
+        while True:
+            left_size = _size(node.left)
+            if index < left_size:
+                node = node.left
+            elif index == left_size:
+                return node.value
+            else:
+                index -= left_size + 1
+                node = node.right
+
+    def rank(self, value):
+        # Number of values in the tree that are smaller than value
+        rank, node = 0, self
+        while node is not None:
+            if value <= node.value:
+                node = node.left
+            else:
+                rank += _size(node.left) + 1
+                node = node.right
+        return rank
+
+def _size(node):
+    return node.size if node is not None else 0
+
+# Note that a node with children is truthy anyway, but an explicit None check doesn't call __len__. The sizes have to
+# be updated whenever nodes are added or removed. A node can't represent an empty tree, so a small container class
+# holds the root and implements insert and remove, keeping the sizes along the search path up to date:
+class OrderStatisticTree(Sequence):
+    def __init__(self, values=()):
+        self.root = None
+        for value in values:
+            self.insert(value)
+
+    def __len__(self):
+        return _size(self.root)
+
+    def __getitem__(self, index):
+        if self.root is None:
+            raise IndexError('Index out of range')
+        return self.root[index]
+
+    def rank(self, value):
+        return self.root.rank(value) if self.root is not None else 0
+
+    def insert(self, value):
+        if self.root is None:
+            self.root = SizedNode(value)
+            return
+        node = self.root
+        while True:
+            node.size += 1
+            if value < node.value:
+                if node.left is None:
+                    node.left = SizedNode(value)
+                    return
+                node = node.left
+            else:
+                if node.right is None:
+                    node.right = SizedNode(value)
+                    return
+                node = node.right
+
+    def remove(self, value):
+        path, node = [], self.root
+        while node is not None and node.value != value:
+            path.append(node)
+            node = node.left if value < node.value else node.right
+        if node is None:
+            raise ValueError('%r not in tree' % (value,))
+
+        if node.left is not None and node.right is not None:
+            # Replace the value by its in-order successor and unlink the successor's node instead
+            target = node
+            path.append(node)
+            node = node.right
+            while node.left is not None:
+                path.append(node)
+                node = node.left
+            target.value = node.value
+
+        child = node.left if node.left is not None else node.right
+        if not path:
+            self.root = child
+        elif path[-1].left is node:
+            path[-1].left = child
+        else:
+            path[-1].right = child
+        for ancestor in path:
+            ancestor.size -= 1
+
+tree = OrderStatisticTree([10, 5, 15, 2, 6, 11, 7])
+print('Tree is', list(tree), 'with length', len(tree))
+print('Index 3 =', tree[3], 'and rank of 11 =', tree.rank(11))
+tree.remove(10)
+tree.remove(2)
+print('After remove:', list(tree), tree[-1])
+
+# Tree is [2, 5, 6, 7, 10, 11, 15] with length 7
+# Index 3 = 7 and rank of 11 = 5
+# After remove: [5, 6, 7, 11, 15] 15
+
+# Indexing, len() and rank are now O(height). Without rebalancing the height is only logarithmic for inserts in
+# random order though, sorted input still degenerates the tree into a list.
+
+
+# Balancing the Tree
+# To guarantee logarithmic height regardless of the insertion order, the tree has to rebalance itself. An AVL tree
+# additionally stores the height of each node and rotates whenever the heights of two sibling subtrees differ by more
+# than one. Rotations only change a constant number of links, so the subtree sizes are easily kept up to date as well:
+class AVLNode(SizedNode):
+    def __init__(self, value, left=None, right=None):
+        super().__init__(value, left=left, right=right)
+        self.height = 1 + max(_height(left), _height(right))
+
+def _height(node):
+    return node.height if node is not None else 0
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+    node.height = 1 + max(_height(node.left), _height(node.right))
+    return node
+
+def _rotate_left(node):
+    pivot = node.right
+    node.right = pivot.left
+    pivot.left = _update(node)
+    return _update(pivot)
+
+def _rotate_right(node):
+    pivot = node.left
+    node.left = pivot.right
+    pivot.right = _update(node)
+    return _update(pivot)
+
+def _rebalance(node):
+    _update(node)
+    balance = _height(node.left) - _height(node.right)
+    if balance > 1:
+        if _height(node.left.left) < _height(node.left.right):
+            node.left = _rotate_left(node.left)
+        return _rotate_right(node)
+    if balance < -1:
+        if _height(node.right.right) < _height(node.right.left):
+            node.right = _rotate_right(node.right)
+        return _rotate_left(node)
+    return node
+
+# Since the height is logarithmic now, insert and remove can safely recurse. The tree also gets the bisect functions
+# known from the bisect module and a range iterator that only visits the nodes inside the range:
+class BalancedTree(OrderStatisticTree):
+    def insert(self, value):
+        self.root = self._insert(self.root, value)
+
+    def _insert(self, node, value):
+        if node is None:
+            return AVLNode(value)
+        if value < node.value:
+            node.left = self._insert(node.left, value)
+        else:
+            node.right = self._insert(node.right, value)
+        return _rebalance(node)
+
+    def remove(self, value):
+        self.root = self._remove(self.root, value)
+
+    def _remove(self, node, value):
+        if node is None:
+            raise ValueError('%r not in tree' % (value,))
+        if value < node.value:
+            node.left = self._remove(node.left, value)
+        elif node.value < value:
+            node.right = self._remove(node.right, value)
+        elif node.left is None:
+            return node.right
+        elif node.right is None:
+            return node.left
+        else:
+            successor = node.right
+            while successor.left is not None:
+                successor = successor.left
+            node.value = successor.value
+            node.right = self._remove_min(node.right)
+        return _rebalance(node)
+
+    def _remove_min(self, node):
+        if node.left is None:
+            return node.right
+        node.left = self._remove_min(node.left)
+        return _rebalance(node)
+
+    def bisect_left(self, value):
+        return self.rank(value)
+
+    def bisect_right(self, value):
+        index, node = 0, self.root
+        while node is not None:
+            if value < node.value:
+                node = node.left
+            else:
+                index += _size(node.left) + 1
+                node = node.right
+        return index
+
+    def irange(self, low=None, high=None):
+        # Yields the values in [low, high) in order, iteratively
+        stack, node = [], self.root
+        while stack or node is not None:
+            if node is not None:
+                if low is not None and node.value < low:
+                    node = node.right  # The left subtree is out of range as well
+                else:
+                    stack.append(node)
+                    node = node.left
+            else:
+                node = stack.pop()
+                if high is not None and not node.value < high:
+                    return
+                yield node.value
+                node = node.right
+
+    def __iter__(self):
+        return self.irange()
+
+    def __contains__(self, value):
+        index = self.bisect_left(value)
+        return index < len(self) and self[index] == value
+
+    def count(self, value):
+        return self.bisect_right(value) - self.bisect_left(value)
+
+    def index(self, value, start=0, stop=None):
+        # Negative bounds count from the end, like in Sequence.index
+        if start < 0:
+            start = max(len(self) + start, 0)
+        if stop is not None and stop < 0:
+            stop += len(self)
+        index = max(self.bisect_left(value), start)
+        if index < len(self) and (stop is None or index < stop) and self[index] == value:
+            return index
+        raise ValueError('%r is not in tree' % (value,))
+
+tree = BalancedTree(range(100000))  # Sorted input
+print('Height is', tree.root.height, 'for', len(tree), 'values')
+print('Index 54321 =', tree[54321], 'and bisect_right(54321) =', tree.bisect_right(54321))
+print('Range:', list(tree.irange(10, 15)))
+for value in range(0, 100000, 2):
+    tree.remove(value)
+print('After remove:', list(tree.irange(high=6)), 'height', tree.root.height)
+
+# Height is 17 for 100000 values
+# Index 54321 = 54321 and bisect_right(54321) = 54322
+# Range: [10, 11, 12, 13, 14]
+# After remove: [1, 3, 5] height 16
+
+
+# Searching by Ordering
+# The methods that BetterNode inherits from Sequence know nothing about the ordering of a binary search tree. The in
+# operator, index and count call __getitem__ for one position after the other, and since each of these calls searches
+# from the root, they are O(n^2). Overriding them to follow the ordering instead makes membership tests O(height). An
+# iterative in-order walk that starts at the first value not smaller than a given one serves for the rest:
+class SearchableNode(BetterNode):
+    def _walk(self, low=None):
+        stack, node = [], self
+        while stack or node is not None:
+            if node is not None:
+                if low is not None and node.value < low:
+                    node = node.right
+                else:
+                    stack.append(node)
+                    node = node.left
+            else:
+                node = stack.pop()
+                yield node.value
+                node = node.right
+
+    def __iter__(self):
+        return self._walk()
+
+    def __len__(self):
+        return sum(1 for _ in self._walk())  # list() asks for the length, which must not recurse either
+
+    def __contains__(self, value):
+        node = self
+        while node is not None:
+            if value == node.value:
+                return True
+            node = node.left if value < node.value else node.right
+        return False
+
+    def count(self, value):
+        count = 0
+        for found in self._walk(value):
+            if found != value:
+                break
+            count += 1
+        return count
+
+    def index(self, value, start=0, stop=None):
+        # Without subtree sizes the position has to be counted, but the walk stops at the first larger value. Only
+        # negative bounds, which count from the end, need the length
+        if start < 0:
+            start = max(len(self) + start, 0)
+        if stop is not None and stop < 0:
+            stop += len(self)
+        for i, found in enumerate(self):
+            if stop is not None and i >= stop or value < found:
+                break
+            if i >= start and found == value:
+                return i
+        raise ValueError('%r is not in tree' % (value,))
+
+tree = SearchableNode(10,
+                      left=SearchableNode(5,
+                                          left=SearchableNode(2),
+                                          right=SearchableNode(6, right=SearchableNode(7))),
+                      right=SearchableNode(15, left=SearchableNode(11)))
+
+print('Tree is', list(tree))
+print('11 in the tree?', 11 in tree, '17 in the tree?', 17 in tree)
+print('Index of 7 is', tree.index(7), 'and count of 10 is', tree.count(10))
+
+# Tree is [2, 5, 6, 7, 10, 11, 15]
+# 11 in the tree? True 17 in the tree? False
+# Index of 7 is 3 and count of 10 is 1
+
+# None of the methods recurse, so even a degenerate tree that is just a long chain of nodes works:
+chain = None
+for value in range(5000):
+    chain = SearchableNode(value, left=chain)
+print('Length', len(chain), 'last', list(chain)[-1], 'index of 4321 is', chain.index(4321))
+
+# Length 5000 last 4999 index of 4321 is 4321
+
+# With subtree sizes, index and count don't need to walk at all, they follow from the bisect functions. That's how
+# BalancedTree above implements all three in O(log n).
+
+
+# Compact Storage
+# Every node is a full Python object with an instance dictionary, which costs about a hundred bytes per value. Read
+# mostly trees can instead be stored in a typed array from the array module. If the values are stored in in-order
+# position, the array is sorted, and a binary search over it visits exactly the nodes of a perfectly balanced tree:
+# the middle element is the root, the middles of both halves are its children and so on. So the child links don't
+# have to be stored at all, and the bisect module performs the descent in C:
+from array import array
+from bisect import bisect_left, bisect_right
+
+class CompactTree(Sequence):
+    def __init__(self, values, typecode='q'):
+        values = sorted(values)  # Linear time if the values are already in order, like from from_node
+        try:
+            self._values = array(typecode, values)
+        except (TypeError, OverflowError):
+            self._values = values  # E.g. strings or big ints, which an array can't hold
+
+    @classmethod
+    def from_node(cls, root, typecode='q'):
+        return cls(SearchableNode._walk(root), typecode)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, index):
+        return self._values[index]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __contains__(self, value):
+        index = bisect_left(self._values, value)
+        return index < len(self._values) and self._values[index] == value
+
+    def count(self, value):
+        return bisect_right(self._values, value) - bisect_left(self._values, value)
+
+    def index(self, value, start=0, stop=None):
+        if start < 0:
+            start = max(len(self._values) + start, 0)
+        if stop is not None and stop < 0:
+            stop += len(self._values)
+        index = max(bisect_left(self._values, value), start)
+        if index < len(self._values) and (stop is None or index < stop) and self._values[index] == value:
+            return index
+        raise ValueError('%r is not in tree' % (value,))
+
+# from_node flattens any existing tree of nodes with the iterative in-order walk from above:
+tree = CompactTree.from_node(BetterNode(10,
+                                        left=BetterNode(5,
+                                                        left=BetterNode(2),
+                                                        right=BetterNode(6, right=BetterNode(7))),
+                                        right=BetterNode(15, left=BetterNode(11))))
+print('Tree is', list(tree), 'and 11 in the tree?', 11 in tree)
+print('Index of 7 is', tree.index(7), 'and count of 10 is', tree.count(10))
+
+# Tree is [2, 5, 6, 7, 10, 11, 15] and 11 in the tree? True
+# Index of 7 is 3 and count of 10 is 1
+
+# The default typecode 'q' holds 64-bit integers, 'd' would hold floats. Values that don't fit into the typecode, like
+# strings, are kept in a plain sorted list instead, which still saves the node objects:
+tree = CompactTree.from_node(BetterNode('m', left=BetterNode('c'), right=BetterNode('x')))
+print('Tree is', list(tree), 'and index of x is', tree.index('x'))
+
+# Tree is ['c', 'm', 'x'] and index of x is 2
+
+# The constructor sorts the values, so any iterable can be passed to it:
+tree = CompactTree([7, 2, 10, 5, 7])
+print('Tree is', list(tree), 'and count of 7 is', tree.count(7))
+
+# Tree is [2, 5, 7, 7, 10] and count of 7 is 2
+
+# A small benchmark compares the memory footprint and the lookup speed with the object-per-node representation:
+import timeit
+import tracemalloc
+
+def build_nodes(values, low, high):
+    if low >= high:
+        return None
+    middle = (low + high) // 2
+    return SearchableNode(values[middle],
+                          left=build_nodes(values, low, middle),
+                          right=build_nodes(values, middle + 1, high))
+
+def measure(build):
+    tracemalloc.start()
+    tree = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return tree, size
+
+def benchmark(count=100000, lookups=10000):
+    values = list(range(0, 2 * count, 2))
+    probes = list(range(0, 2 * count, 2 * count // lookups))
+    for name, build in [('Nodes', lambda: build_nodes(values, 0, len(values))),
+                        ('Compact', lambda: CompactTree(values))]:
+        tree, size = measure(build)
+        seconds = timeit.timeit(lambda: [probe in tree for probe in probes], number=1)
+        print('%-8s %6.1f bytes per value, %5.2f us per lookup' % (name, size / count, seconds / lookups * 1e6))
+
+benchmark()
+
+# Nodes      96.0 bytes per value,  0.99 us per lookup
+# Compact     8.0 bytes per value,  0.83 us per lookup
+
+# The array needs twelve times less memory and is a bit faster to search, since most of the remaining time is spent
+# calling __contains__. The price is that the tree is static: inserting into the array is O(n), so trees that change
+# frequently are better served by BalancedTree.
+
+
+# Maintaining Counts Incrementally
+# FrequencyList.frequency() above counts all members again on every call. If the counts are polled more often than the
+# list changes, it's cheaper to keep a Counter up to date in every method that adds or removes members. Methods that
+# only reorder members, like sort and reverse, can be left alone:
+from collections import Counter
+from types import MappingProxyType
+
+class CountingFrequencyList(FrequencyList):
+    def __init__(self, members=()):
+        super().__init__(members)
+        self._counts = Counter(self)
+
+    def _add(self, items):
+        self._counts.update(items)
+
+    def _discard(self, items):
+        self._counts.subtract(items)
+        for item in set(items):
+            if not self._counts[item]:
+                del self._counts[item]
+
+    def append(self, item):
+        super().append(item)
+        self._counts[item] += 1
+
+    def extend(self, items):
+        items = list(items)
+        super().extend(items)
+        self._add(items)
+
+    def insert(self, index, item):
+        super().insert(index, item)
+        self._counts[item] += 1
+
+    def pop(self, index=-1):
+        item = super().pop(index)
+        self._discard([item])
+        return item
+
+    def remove(self, item):
+        super().remove(item)
+        self._discard([item])
+
+    def clear(self):
+        super().clear()
+        self._counts.clear()
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = list(value)
+            removed = self[index]
+            super().__setitem__(index, value)
+            self._discard(removed)
+            self._add(value)
+        else:
+            removed = self[index]
+            super().__setitem__(index, value)
+            self._discard([removed])
+            self._counts[value] += 1
+
+    def __delitem__(self, index):
+        removed = self[index] if isinstance(index, slice) else [self[index]]
+        super().__delitem__(index)
+        self._discard(removed)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def __imul__(self, factor):
+        super().__imul__(factor)
+        if factor > 0:
+            for item in self._counts:
+                self._counts[item] *= factor
+        else:
+            self._counts.clear()
+        return self
+
+    def count(self, item):
+        return self._counts[item]
+
+    def frequency(self):
+        return MappingProxyType(self._counts)  # A read-only live view, copying would cost O(distinct members)
+
+    def most_common(self, k=None):
+        return self._counts.most_common(k)
+
+# Slice assignments first take a copy of the replaced members, so an invalid assignment, e.g. of the wrong length to
+# an extended slice, raises before the counts are touched:
+foo = CountingFrequencyList(['a', 'b', 'a', 'c', 'b', 'a', 'd'])
+foo.pop()
+foo[1:3] = ['c', 'c', 'e']
+del foo[0]
+print('After changes:', repr(foo))
+print('Frequency:', dict(foo.frequency()), 'count of c:', foo.count('c'))
+print('Most common:', foo.most_common(2))
+
+# After changes: ['c', 'c', 'e', 'c', 'b', 'a']
+# Frequency: {'a': 1, 'b': 1, 'c': 3, 'e': 1} count of c: 3
+# Most common: [('c', 3), ('a', 1)]
+
+# The counts are now available in O(1) per item and most_common(k) only has to look at the distinct members, at the
+# cost of a small overhead on every modification. frequency() returns a read-only view of the counts in O(1), which
+# reflects later changes of the list; dict(foo.frequency()) takes a snapshot.
+
+
+# Frequencies of Unbounded Streams
+# A list has to hold every member to count it, which doesn't work for event streams that never end. Often only the
+# recent past is of interest though. A tracker for a sliding window keeps the members of the last N items or T seconds
+# in a deque and counts them incrementally like above, evicting the oldest members as the window moves on:
+import math
+import time
+from collections import deque
+
+class WindowedFrequency(object):
+    def __init__(self, max_items=None, max_age=None, clock=time.monotonic):
+        self.max_items = max_items
+        self.max_age = max_age  # In seconds
+        self.clock = clock
+        self._window = deque()  # (timestamp, item) pairs
+        self._counts = Counter()
+
+    def add(self, item):
+        self._window.append((self.clock(), item))
+        self._counts[item] += 1
+        self._evict()
+
+    def _evict(self):
+        window, counts = self._window, self._counts
+        deadline = self.clock() - self.max_age if self.max_age is not None else None
+        while window and (self.max_items is not None and len(window) > self.max_items or
+                          deadline is not None and window[0][0] < deadline):
+            _, item = window.popleft()
+            counts[item] -= 1
+            if not counts[item]:
+                del counts[item]
+
+    def frequency(self):
+        self._evict()
+        return dict(self._counts)
+
+    def most_common(self, k=None):
+        self._evict()
+        return self._counts.most_common(k)
+
+# For frequencies over the whole stream, exact counts need memory proportional to the number of distinct members.
+# Approximations trade a bounded error for bounded memory. A count-min sketch adds every item to one counter in each of
+# several rows, chosen by a different hash per row. Collisions can only increase counters, so the smallest of the
+# counters is the best estimate. With width e/epsilon and ln(1/delta) rows, it overestimates by more than epsilon
+# times the stream length only with probability delta. The sketch can't list its members, though, so the Space-Saving
+# algorithm additionally tracks the k most frequent ones: when a new item arrives while all k slots are taken, it
+# replaces the item with the smallest count and inherits that count as its possible error:
+class ApproximateFrequency(object):
+    def __init__(self, epsilon=0.001, delta=0.01, k=100):
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.k = k
+        self.total = 0
+        self._rows = [array('q', [0]) * self.width for _ in range(self.depth)]  # 64-bit counters, 'l' is 32 on Windows
+        self._heavy = {}  # item -> [count, error]
+
+    def add(self, item, count=1):
+        self.total += count
+        for seed, row in enumerate(self._rows):
+            row[hash((seed, item)) % self.width] += count
+
+        heavy = self._heavy
+        if item in heavy:
+            heavy[item][0] += count
+        elif len(heavy) < self.k:
+            heavy[item] = [count, 0]
+        else:
+            smallest = min(heavy, key=lambda key: heavy[key][0])  # O(k)
+            minimum = heavy.pop(smallest)[0]
+            heavy[item] = [minimum + count, minimum]
+
+    def estimate(self, item):
+        return min(row[hash((seed, item)) % self.width] for seed, row in enumerate(self._rows))
+
+    def frequency(self):
+        # Estimated counts of the tracked heavy hitters, the sketch bounds each from above
+        return {item: min(count, self.estimate(item)) for item, (count, _) in self._heavy.items()}
+
+    def most_common(self, k=None):
+        return sorted(self.frequency().items(), key=lambda item: item[1], reverse=True)[:k]
+
+# Memory is fixed at width * depth counters plus k entries, e.g. 2719 * 5 counters for epsilon=0.001 and delta=0.01.
+# Python randomizes the hashes of strings per process, so sketches of different processes can't be combined. With a
+# skewed stream of 200000 items, both trackers find the most common members:
+import random
+
+random.seed(1234)
+window = WindowedFrequency(max_items=10000)
+approximate = ApproximateFrequency(epsilon=0.001, delta=0.01, k=20)
+exact = Counter()
+for _ in range(200000):
+    item = int(random.paretovariate(1.0))
+    window.add(item)
+    approximate.add(item)
+    exact[item] += 1
+
+print('Window:', window.most_common(3))
+print('Approximate:', approximate.most_common(3))
+print('Exact:', exact.most_common(3))
+
+# Window: [(1, 5044), (2, 1662), (3, 820)]
+# Approximate: [(1, 99852), (2, 33363), (3, 16438)]
+# Exact: [(1, 99852), (2, 33363), (3, 16438)]